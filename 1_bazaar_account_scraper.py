@@ -1,87 +1,139 @@
-import requests
-import time
-import csv
-from concurrent.futures import ThreadPoolExecutor
-import threading
+import argparse
+
+from checkpoint import RangeCheckpoint
+import coordinator
+from id_probe import IDProber
+import metrics
+from keypool import APIKey, KeyPool, load_keys
+from metrics import USERS_PROCESSED
+from recheck import status_for_last_action
+from response_cache import ResponseCache
+from state_index import StateIndex, UNKNOWN, LISTED, BANNED
 
 #this step is time consuming and inefficient, but I didnt think to do it all with the inactivity filter and I havent had enough fucks to give to 
 #edit that program to do what this one does yet and this one formats it in a way the other one needs to run so yeah
 
-# APIKey class to manage key usage and rate limiting
-class APIKey:
-    def __init__(self, key, holder_name, sleep_value, call_number=0):
-        """Initialize an API key with holder's name, sleep value, and call number."""
-        self.key = key
-        self.holder_name = holder_name
-        self.sleep_value = sleep_value  # Time to sleep between calls to avoid rate limiting
-        self.call_number = call_number  # Tracks the number of calls made with this key
-
-    def make_request(self, url):
-        """Make an API request and apply sleep to respect the rate limit."""
-        print(f"Making request with API key {self.key} (Holder: {self.holder_name})")
-        response = requests.get(url)
-        time.sleep(self.sleep_value)  # Apply the sleep value to respect the rate limit
-        self.call_number += 1
-        return response
-
 # Initialize multiple API keys
 api_keys = [
 ]
 
-BASE_URL = 'https://api.torn.com/user/'
 START_ID = 1
 END_ID = 3500000  # Ending at 3.5 million
 
-# Create a thread lock for synchronized file writing
-file_lock = threading.Lock()
+# Selections for --fused: the profile rides along in the same call, so new users never need a stage 2 call
+FUSED_SELECTIONS = 'publicStatus,profile'
 
 # Function to fetch publicStatus data using a specific APIKey instance
 def fetch_public_status(user_id, api_key_obj):
-    """Fetches public status for a given user ID from the Torn API using the provided APIKey."""
-    url = f'{BASE_URL}{user_id}?selections=publicStatus&key={api_key_obj.key}'
-    response = api_key_obj.make_request(url)
-    if response.status_code == 200:
-        return response.json()
+    """Fetches public status for a given user ID from the Torn API (or the response cache) using the provided APIKey."""
+    return api_key_obj.fetch_user(user_id, 'publicStatus')
+
+# Function to reduce a user's publicStatus to LISTED, BANNED or None (no such user)
+def public_status(user_id, api_key_obj):
+    """Returns only what the scan records, so a worker process can send it to the coordinator."""
+    data = fetch_public_status(user_id, api_key_obj)
+    if data:
+        return BANNED if data.get('banned', False) else LISTED
+    return None
+
+# Function to record one user's status in the CSV (once its range is done) and the state index
+def record_public_status(user_id, status, checkpoint, index):
+    if status == LISTED:
+        checkpoint.add(user_id, [user_id])  # Written with the rest of its ID range
+        if index.status(user_id) in (UNKNOWN, BANNED):  # Don't undo what the inactivity filter found
+            index.set(user_id, LISTED)
+        USERS_PROCESSED.inc(stage='1', result='listed')
+    elif status == BANNED:
+        index.set(user_id, BANNED)
+        USERS_PROCESSED.inc(stage='1', result='banned')
     else:
-        print(f"Failed to fetch data for user {user_id}: {response.status_code}")
-        return None
-
-# Function to process a range of user IDs for a specific APIKey instance
-def check_public_statuses(start_id, end_id, api_key_obj, writer):
-    """Checks the public status of users in a given range and writes results immediately to CSV."""
-    for user_id in range(start_id, end_id + 1):
-        data = fetch_public_status(user_id, api_key_obj)
-        if data:
-            banned = data.get('banned', False)
-            if not banned:
-                with file_lock:  # Ensure only one thread writes at a time
-                    writer.writerow([user_id])  # Write the user ID to the CSV file immediately
-                print(f"User {user_id} written to CSV.")  # Optional: log progress
-        time.sleep(api_key_obj.sleep_value)  # Respect rate limit between calls
-
-# Function to distribute work across multiple API keys and save results to CSV
-def process_with_multiple_keys(start_id, end_id, api_keys):
-    total_users = end_id - start_id + 1
-    users_per_key = total_users // len(api_keys)
-
-    with open('active_users.csv', 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(['User ID'])  # Only store User ID
-
-        # Use ThreadPoolExecutor for parallel processing
-        with ThreadPoolExecutor(max_workers=len(api_keys)) as executor:
-            futures = []
-            for i, api_key in enumerate(api_keys):
-                key_start = start_id + i * users_per_key
-                key_end = start_id + (i + 1) * users_per_key - 1
-                if i == len(api_keys) - 1:
-                    key_end = end_id  # Ensure the last key handles the remaining range
-
-                # Submit each API key to handle its range
-                futures.append(executor.submit(
-                    check_public_statuses, key_start, key_end, api_key, writer
-                ))
+        USERS_PROCESSED.inc(stage='1', result='missing')  # No such user; failed calls are retried by the pool
+
+# Function to check a single user ID with whichever APIKey picked it up
+def check_public_status(user_id, api_key_obj, checkpoint, index):
+    """Checks the public status of a user and records the result in the CSV (once its range is done) and the state index."""
+    record_public_status(user_id, public_status(user_id, api_key_obj), checkpoint, index)
+
+# Function to fetch publicStatus and profile in one call and reduce them to [status, last action]
+def fused_status(user_id, api_key_obj):
+    data = api_key_obj.fetch_user(user_id, FUSED_SELECTIONS)
+    if not data:
+        return [None, None]
+    if data.get('banned', False):
+        return [BANNED, None]
+    return [LISTED, data.get('last_action', {}).get('timestamp')]
+
+# Function to record a fused result: listed users go straight to active or inactive, as stage 2 would file them
+def record_fused_status(user_id, result, checkpoint, index):
+    status, last_action = result
+    record_public_status(user_id, status, checkpoint, index)
+    if status == LISTED and last_action:
+        index.set(user_id, status_for_last_action(last_action), last_action=last_action)
+
+# Function to check a single user ID with one fused call
+def check_fused_status(user_id, api_key_obj, checkpoint, index):
+    record_fused_status(user_id, fused_status(user_id, api_key_obj), checkpoint, index)
+
+
+# Function to spread the ID range across all API keys and save results to CSV
+def process_with_multiple_keys(start_id, end_id, api_keys, coordinate_address=None, fused=False, probe=False):
+    index = StateIndex()  # Shared with the inactivity filter; seeded from the old CSVs when it is first created
+    cache = ResponseCache()
+    check, fetch, record = check_public_status, public_status, record_public_status
+    if fused:
+        check, fetch, record = check_fused_status, fused_status, record_fused_status
+
+    # With probe, sampling (and what earlier runs found) decides which regions of the ID space are swept
+    id_range = range(start_id, end_id + 1)
+    if probe and not api_keys:
+        print("Probing needs API keys on this machine; scanning the whole range.")
+    elif probe:
+        status = (lambda user_id, api_key: fused_status(user_id, api_key)[0]) if fused else public_status
+        id_range = IDProber(KeyPool(api_keys, cache), status).plan(start_id, end_id, index)
+
+    # Finished ID ranges are checkpointed, so a crashed scan resumes instead of starting again at START_ID
+    checkpoint = RangeCheckpoint('active_users.checkpoint', 'active_users.csv', ['User ID'])  # Only store User ID
+    user_ids = checkpoint.resume(id_range)
+
+    if coordinate_address is None:
+        # Every key pulls the next ID from one shared queue, so a slow key never holds up a slice
+        KeyPool(api_keys, cache).run(
+            user_ids,
+            lambda user_id, api_key: check(user_id, api_key, checkpoint, index),
+            checkpoint.finished
+        )
+    else:
+        # Worker processes fetch leased chunks with their own keys; their results are recorded here
+        def merge(user_id, result, worker, ok):
+            if ok:
+                record(user_id, result, checkpoint, index)
+            checkpoint.finish(user_id, worker, ok)
+
+        coordinator.coordinate(user_ids, merge, coordinate_address, api_keys, fetch, cache)
+    checkpoint.close()
+    index.close()
+    cache.report()
+    cache.close()
+
 
 # Main execution
 if __name__ == "__main__":
-    process_with_multiple_keys(START_ID, END_ID, api_keys)
+    parser = argparse.ArgumentParser(description="Find every non-banned account between START_ID and END_ID.")
+    metrics.add_arguments(parser, gui=False)
+    coordinator.add_arguments(parser)
+    parser.add_argument('--fused', action='store_true',
+                        help="fetch the profile in the same call so new users skip the inactivity filter")
+    parser.add_argument('--probe', action='store_true',
+                        help="sample the ID space first and skip regions without accounts instead of sweeping it all")
+    args = parser.parse_args()
+    metrics.start_exporters(args)
+    if args.keys_file:
+        api_keys = load_keys(args.keys_file)
+    if args.worker:
+        cache = ResponseCache()
+        coordinator.run_worker(args.worker, api_keys, fused_status if args.fused else public_status, cache)
+        cache.report()
+        cache.close()
+    else:
+        process_with_multiple_keys(START_ID, END_ID, api_keys, args.coordinate, args.fused, args.probe)
+    metrics.finish_exporters(args)
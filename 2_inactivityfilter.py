@@ -1,51 +1,25 @@
-import requests
-import time
+import argparse
 import csv
-from concurrent.futures import ThreadPoolExecutor
+import os
 from datetime import datetime, timezone, timedelta
 import threading
-import tkinter as tk
 
+from batch_writer import BatchWriter
+import coordinator
+from journal import Journal
+import metrics
+from keypool import APIKey, KeyPool, load_keys
+from metrics import USERS_PROCESSED
+from recheck import plan_run
+from response_cache import ResponseCache
+from state_index import StateIndex, ACTIVE, INACTIVE, BLACKLISTED
 
-# APIKey class to manage key usage and rate limiting
-class APIKey:
-    def __init__(self, key, holder_name, calls_per_minute):
-        self.key = key
-        self.holder_name = holder_name
-        self.sleep_value = 60 / calls_per_minute
 
-    def make_request(self, url):
-        response = requests.get(url)
-        time.sleep(self.sleep_value)  # Sleep based on the API rate limit
-        return response
-
-
-def load_csv_to_set(csv_file):
-    """Utility function to load user IDs from a CSV file into a set."""
-    user_set = set()
-    try:
-        with open(csv_file, 'r') as file:
-            reader = csv.reader(file)
-            next(reader)  # Skip the header row
-            for row in reader:
-                if row and row[0].isdigit():  # Ensure it's a number
-                    user_set.add(int(row[0]))
-    except FileNotFoundError:
-        print(f"{csv_file} not found. Starting fresh.")
-    return user_set
-
-
-def save_set_to_csv(data_set, csv_file):
-    with open(csv_file, 'w', newline='') as file:
-        csv.writer(file).writerows([[user_id] for user_id in data_set])
-
-
-# Fetch last action timestamp from API
+# Fetch last action timestamp from API (None only if the user doesn't exist; API errors are raised and retried)
 def fetch_last_action(user_id, api_key_obj):
-    url = f'https://api.torn.com/user/{user_id}?selections=profile&key={api_key_obj.key}'
-    response = api_key_obj.make_request(url)
-    if response.status_code == 200:
-        return response.json().get('last_action', {}).get('timestamp')
+    data = api_key_obj.fetch_user(user_id, 'profile')
+    if data is not None:
+        return data.get('last_action', {}).get('timestamp')
     return None
 
 
@@ -57,81 +31,118 @@ def is_active(last_action_timestamp):
     return False
 
 
-# Process a batch of user IDs
-def process_users(user_ids, api_key_obj, writer, processed_users, blacklist, recently_checked, csvfile):
-    for user_id in user_ids:
-        if user_id in processed_users or user_id in blacklist or user_id in recently_checked:
-            continue
+# Record a user's last action (None if the user doesn't exist) through the journal
+def record_user(user_id, last_action, output, index, journal):
+    if last_action is None:
+        journal.add(BLACKLISTED, user_id)  # Applied to the index by the journal's writer thread
+        USERS_PROCESSED.inc(stage='2', result='blacklisted')
+    elif is_active(last_action):
+        if index.status(user_id) != ACTIVE:  # Re-checked active users are already in the CSV
+            output.writerow([user_id, last_action])  # Queued for the writer thread
+        journal.add(ACTIVE, user_id, last_action)
+        USERS_PROCESSED.inc(stage='2', result='active')
+    else:
+        journal.add(INACTIVE, user_id, last_action)
+        USERS_PROCESSED.inc(stage='2', result='inactive')
+
 
-        last_action = fetch_last_action(user_id, api_key_obj)
-        if last_action is None:
-            blacklist.add(user_id)
-            save_set_to_csv(blacklist, 'blacklist.csv')
-        elif is_active(last_action):
-            writer.writerow([user_id, last_action])
-            csvfile.flush()
-        else:
-            recently_checked.add(user_id)
-            save_set_to_csv(recently_checked, 'recently_checked.csv')
+# Process a single user ID
+def process_user(user_id, api_key_obj, output, index, journal):
+    record_user(user_id, fetch_last_action(user_id, api_key_obj), output, index, journal)
+
+
+# Rewrite the filtered CSV from the index so users that went inactive drop out of it
+def export_active_users(index, csv_file):
+    tmp_file = csv_file + '.tmp'
+    with open(tmp_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['User ID', 'Last Action Timestamp'])
+        writer.writerows([user_id, index.last_action(user_id)] for user_id in index.ids_with_status(ACTIVE))
+    os.replace(tmp_file, csv_file)
 
 
 # Handle multi-threaded API processing
-def process_with_multiple_keys(user_ids, api_keys, processed_users, blacklist, recently_checked):
-    # Convert set to list for slicing
-    user_ids_list = list(user_ids)  # Convert the set to a list here
-    users_per_key = len(user_ids_list) // len(api_keys)
-
-    with open('active_users_filtered.csv', 'a', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        if csvfile.tell() == 0:  # Write the header only if the file is new
-            writer.writerow(['User ID', 'Last Action Timestamp'])
-
-        with ThreadPoolExecutor(max_workers=len(api_keys)) as executor:
-            futures = [
-                executor.submit(
-                    process_users, user_ids_list[i * users_per_key: (i + 1) * users_per_key],
-                    api_key, writer, processed_users, blacklist, recently_checked, csvfile
-                ) for i, api_key in enumerate(api_keys)
-            ]
-            for future in futures:
-                future.result()
-
-
-# Tkinter display updater
-def update_display():
-    total_processed_label.config(text=f"Processed: {len(processed_users)}")
-    blacklisted_label.config(text=f"Blacklisted: {len(blacklist)}")
-    inactive_label.config(text=f"Inactive: {len(recently_checked)}")
-    root.after(2000, update_display)
+def process_with_multiple_keys(user_ids, api_keys, index, journal, cache, coordinate_address=None):
+    # New active users are appended by one writer thread in batches (the header only if the file is new)
+    output = BatchWriter('active_users_filtered.csv', header=['User ID', 'Last Action Timestamp'])
+
+    if coordinate_address is None:
+        # All keys pull from one shared queue of user IDs
+        KeyPool(api_keys, cache).run(
+            user_ids,
+            lambda user_id, api_key: process_user(user_id, api_key, output, index, journal)
+        )
+    else:
+        # Worker processes send back last actions; users they gave up on stay due for the next run
+        def merge(user_id, last_action, worker, ok):
+            if ok:
+                record_user(user_id, last_action, output, index, journal)
+
+        coordinator.coordinate(user_ids, merge, coordinate_address, api_keys, fetch_last_action, cache)
+    output.close()
+    journal.close()  # Flush the index and re-export the blacklist and recently_checked CSVs
+    export_active_users(index, 'active_users_filtered.csv')
+    cache.report()
+
+
+# Progress lines for the optional Tk window, read from the metrics registry
+def describe_progress():
+    return [
+        f"Processed: {USERS_PROCESSED.value(stage='2')}",
+        f"Active: {USERS_PROCESSED.value(stage='2', result='active')}",
+        f"Blacklisted: {USERS_PROCESSED.value(stage='2', result='blacklisted')}",
+        f"Inactive: {USERS_PROCESSED.value(stage='2', result='inactive')}",
+    ]
 
 
 # Main program
-if __name__ == "__main__":
-    # Load data
-    processed_users = load_csv_to_set('active_users_filtered.csv')
-    blacklist = load_csv_to_set('blacklist.csv')
-    recently_checked = load_csv_to_set('recently_checked.csv')
-
-    user_ids = load_csv_to_set('active_users.csv')
+def main():
+    parser = argparse.ArgumentParser(description="Split the scraped accounts into active, inactive and blacklisted.")
+    metrics.add_arguments(parser)
+    coordinator.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start_exporters(args)
 
     # Declare the API keys before processing
     api_keys = [
         # Add more API keys as needed
     ]
+    if args.keys_file:
+        api_keys = load_keys(args.keys_file)
+
+    if args.worker:
+        # A worker only fetches; the coordinator owns the index and the journal
+        cache = ResponseCache()
+        coordinator.run_worker(args.worker, api_keys, fetch_last_action, cache)
+        cache.report()
+        metrics.finish_exporters(args)
+        return
+
+    # Load the shared state index (it imports the old CSVs the first time it is created)
+    index = StateIndex()
+
+    # Status changes go through the journal so a crash loses nothing since the last compaction
+    journal = Journal('inactivity_journal.log', index, {
+        BLACKLISTED: 'blacklist.csv',
+        INACTIVE: 'recently_checked.csv',
+    })
+
+    # New users from the account scraper, then users whose status may have changed since their last check
+    user_ids = plan_run(index)
+
+    # Profiles fetched by a crashed or repeated run are reused instead of spending calls again
+    cache = ResponseCache()
+
+    journal.start()
+    if args.headless:
+        process_with_multiple_keys(user_ids, api_keys, index, journal, cache, args.coordinate)
+    else:
+        # Start the background processing and the GUI, which only reads the metrics
+        threading.Thread(target=lambda: process_with_multiple_keys(
+            user_ids, api_keys, index, journal, cache, args.coordinate)).start()
+        metrics.show_progress_window("Progress Tracker", describe_progress, 2000)
+    metrics.finish_exporters(args)
+
 
-    # Tkinter setup
-    root = tk.Tk()
-    root.title("Progress Tracker")
-    total_processed_label = tk.Label(root, text="Processed: 0")
-    total_processed_label.pack()
-    blacklisted_label = tk.Label(root, text="Blacklisted: 0")
-    blacklisted_label.pack()
-    inactive_label = tk.Label(root, text="Inactive: 0")
-    inactive_label.pack()
-
-    # Start the GUI and background processing
-    threading.Thread(target=lambda: process_with_multiple_keys(
-        user_ids, api_keys, processed_users, blacklist, recently_checked)).start()
-
-    root.after(2000, update_display)
-    root.mainloop()
+if __name__ == "__main__":
+    main()
@@ -1,169 +1,284 @@
-import csv
-import requests
-import time
-from concurrent.futures import ThreadPoolExecutor
+import argparse
+import os
 import threading
-import tkinter as tk
-
-
-# APIKey class to manage key usage and rate limiting
-class APIKey:
-    def __init__(self, key, holder_name, calls_per_minute=60):
-        """Initialize an API key with holder's name and calls per minute."""
-        self.key = key
-        self.holder_name = holder_name
-        self.calls_per_minute = calls_per_minute
-
-        # Calculate sleep value based on calls_per_minute
-        self.sleep_value = 60 / self.calls_per_minute
-        self.call_number = 0  # Tracks the number of calls made with this key
-
-    def make_request(self, url):
-        """Make an API request and apply sleep to respect the rate limit."""
-        print(f"Making request with API key {self.key} (Holder: {self.holder_name})")
-        response = requests.get(url)
-        time.sleep(self.sleep_value)  # Apply the sleep value to respect the rate limit
-        self.call_number += 1
-        return response
-
-
-# Torn API URL to fetch bazaar data
-BAZAAR_URL = "https://api.torn.com/user/{user_id}?selections=bazaar&key={api_key}"
-
-# Create a thread lock for synchronized file writing
-file_lock = threading.Lock()
-
-
-# Function to fetch bazaar data for a user and write to the CSV immediately
-def fetch_and_write_bazaar_data(user_ids, api_key_obj, writer, output_file, progress_var, total_users):
-    for user_id in user_ids:
-        url = BAZAAR_URL.format(user_id=user_id, api_key=api_key_obj.key)
-        response = api_key_obj.make_request(url)
-        if response.status_code == 200:
-            try:
-                data = response.json()
-
-                # Check if the 'bazaar' field is a list or a dictionary
-                bazaar_data = data.get('bazaar')
-
-                if isinstance(bazaar_data, list):
-                    # Handle bazaar as a list
-                    if len(bazaar_data) > 0:
-                        with file_lock:  # Ensure only one thread writes at a time
-                            for item in bazaar_data:
-                                writer.writerow({
-                                    'player_id': user_id,
-                                    'item_name': item['name'],
-                                    'price': item['price'],
-                                    'quantity': item['quantity']
-                                })
-                                print(f"User {user_id}: Added item {item['name']} to CSV.")
-                            output_file.flush()  # Force data to be written immediately
-                    else:
-                        print(f"User {user_id} has a bazaar but no items listed.")
-                elif isinstance(bazaar_data, dict):
-                    # Handle bazaar as a dictionary (if it ever returns this way)
-                    with file_lock:  # Ensure only one thread writes at a time
-                        for item_id, item_info in bazaar_data.items():
-                            writer.writerow({
-                                'player_id': user_id,
-                                'item_name': item_info['name'],
-                                'price': item_info['price'],
-                                'quantity': item_info['quantity']
-                            })
-                            print(f"User {user_id}: Added item {item_info['name']} to CSV.")
-                        output_file.flush()  # Force data to be written immediately
-                else:
-                    print(f"User {user_id}: Bazaar is of unexpected type {type(bazaar_data)}. Skipping.")
-
-            except Exception as e:
-                print(f"Error processing bazaar for user {user_id}: {e}")
-        else:
-            print(f"Failed to fetch bazaar data for user {user_id}. Status code: {response.status_code}")
-
-        # Update the progress
-        with file_lock:
-            progress_var.set(progress_var.get() + 1)
-
-
-# Function to distribute work across multiple API keys and save results to CSV
-def process_with_multiple_keys(user_ids, api_keys, writer, output_file, progress_var):
-    total_users = len(user_ids)
-    users_per_key = total_users // len(api_keys)
-
-    # Use ThreadPoolExecutor for parallel processing
-    with ThreadPoolExecutor(max_workers=len(api_keys)) as executor:
-        futures = []
-        for i, api_key in enumerate(api_keys):
-            start_idx = i * users_per_key
-            end_idx = (i + 1) * users_per_key
-            if i == len(api_keys) - 1:
-                end_idx = total_users  # Ensure the last key handles the remaining users
-
-            # Submit each API key to handle its range of user IDs
-            user_ids_chunk = user_ids[start_idx:end_idx]
-            futures.append(executor.submit(
-                fetch_and_write_bazaar_data, user_ids_chunk, api_key, writer, output_file, progress_var, total_users
-            ))
 
-        # Wait for all threads to complete
-        for future in futures:
-            future.result()
-
-
-# Function to start processing in the background
-def start_processing(user_ids, api_keys, writer, output_file, progress_var):
-    threading.Thread(target=process_with_multiple_keys,
-                     args=(user_ids, api_keys, writer, output_file, progress_var)).start()
+import bazaar_deltas
+from bazaar_schedule import BazaarHistory, import_bazaar_users
+from bazaar_snapshot import SnapshotWriter
+from checkpoint import RangeCheckpoint
+import coordinator
+from csv_loader import load_ids
+from deal_alerts import DealAlerter, SellPriceWatcher, StdoutSink, FileSink
+from journal import Journal
+import metrics
+from keypool import APIKey, KeyPool, load_keys
+from metrics import USERS_PROCESSED, LISTINGS_SEEN
+import price_stats
+from query_service import QueryServicePublisher
+from recheck import status_for_last_action
+from response_cache import ResponseCache
+from state_index import StateIndex, INACTIVE, BLACKLISTED
+
+
+# Columns of sorted_bazaars.csv and of the checkpointed partial crawl
+FIELDNAMES = ['player_id', 'item_name', 'price', 'quantity']
+
+# A resumed crawl older than this starts over, since the listings it kept have gone stale
+CHECKPOINT_MAX_AGE = 6 * 3600
+
+# Selections for --fused: the profile rides along with the bazaar, so the crawl also refreshes every user's activity
+FUSED_SELECTIONS = 'profile,bazaar'
+
+
+# Function to pull the bazaar listings out of a response
+def bazaar_listings(data):
+    bazaar_data = data.get('bazaar')
+
+    # The bazaar normally comes back as a list; handle a dictionary too (if it ever returns this way)
+    if isinstance(bazaar_data, dict):
+        bazaar_data = list(bazaar_data.values())
+    return bazaar_data
+
+
+# Function to fetch a user's bazaar listings (None if the user doesn't exist)
+def fetch_bazaar(user_id, api_key_obj):
+    data = api_key_obj.fetch_user(user_id, 'bazaar')  # Served from the response cache if fetched recently
+    if data is None:
+        return None
+    return bazaar_listings(data)
+
+
+# Function to fetch profile and bazaar in one call: [last action, listings], or None if the user doesn't exist
+def fetch_fused(user_id, api_key_obj):
+    data = api_key_obj.fetch_user(user_id, FUSED_SELECTIONS)
+    if data is None:
+        return None
+    return [data.get('last_action', {}).get('timestamp'), bazaar_listings(data)]
+
+
+# Function to record a user's bazaar in the snapshot and the checkpointed output
+def record_bazaar(user_id, bazaar_data, checkpoint, snapshot, alerter=None, publisher=None, history=None):
+    if bazaar_data is None or isinstance(bazaar_data, list):
+        snapshot.reach(user_id)  # Even an empty or missing bazaar replaces what the last crawl found
+        if publisher is not None:
+            publisher.publish(user_id, bazaar_data)  # A running query service sees the bazaar right away
+    if history is not None and bazaar_data is None:
+        history.record(user_id, None)
+    if bazaar_data is not None:
+        try:
+            if isinstance(bazaar_data, list):
+                deals = 0
+                if len(bazaar_data) > 0:
+                    # Check for deals before touching the disk so alerts go out right away
+                    if alerter is not None:
+                        deals = alerter.check(user_id, bazaar_data)
+                    for item in bazaar_data:
+                        snapshot.add(user_id, item['name'], item['price'], item['quantity'])
+                        # Written to disk with the rest of its ID range (the streaming pipeline has no ranges)
+                        if checkpoint is not None:
+                            checkpoint.add(user_id, [user_id, item['name'], item['price'], item['quantity']])
+                    LISTINGS_SEEN.inc(len(bazaar_data))
+                    USERS_PROCESSED.inc(stage='4', result='listed')
+                else:
+                    USERS_PROCESSED.inc(stage='4', result='empty')
+                if history is not None:
+                    history.record(user_id, bazaar_data, deals)  # How often this owner is worth crawling
+            else:
+                print(f"User {user_id}: Bazaar is of unexpected type {type(bazaar_data)}. Skipping.")
+                USERS_PROCESSED.inc(stage='4', result='failed')
+
+        except Exception as e:
+            print(f"Error processing bazaar for user {user_id}: {e}")
+            USERS_PROCESSED.inc(stage='4', result='failed')
+    else:
+        USERS_PROCESSED.inc(stage='4', result='missing')  # No such user; failed calls are retried by the pool
+
+
+# Function to fetch bazaar data for a user and record it immediately
+def fetch_and_write_bazaar_data(user_id, api_key_obj, checkpoint, snapshot, alerter=None, publisher=None,
+                                history=None):
+    record_bazaar(user_id, fetch_bazaar(user_id, api_key_obj), checkpoint, snapshot, alerter, publisher, history)
+
+
+# Function to route a fused result: the profile to the inactivity journal, the bazaar to the snapshot
+def record_fused(user_id, result, checkpoint, snapshot, alerter, journal, publisher=None, history=None):
+    if result is None:
+        journal.add(BLACKLISTED, user_id)  # Gone, the same as the inactivity filter would find
+        record_bazaar(user_id, None, checkpoint, snapshot, alerter, publisher, history)
+        return
+    last_action, bazaar_data = result
+    journal.add(status_for_last_action(last_action), user_id, last_action)  # Spares stage 2 its re-check
+    record_bazaar(user_id, bazaar_data, checkpoint, snapshot, alerter, publisher, history)
+
+
+# Function to fetch profile and bazaar for a user in one call and record both
+def fetch_and_write_fused(user_id, api_key_obj, checkpoint, snapshot, alerter, journal, publisher=None,
+                          history=None):
+    record_fused(user_id, fetch_fused(user_id, api_key_obj), checkpoint, snapshot, alerter, journal, publisher,
+                 history)
+
+
+# Function to distribute work across multiple API keys and save results
+def process_with_multiple_keys(user_ids, api_keys, checkpoint, snapshot, snapshot_path, alerter=None,
+                               coordinate_address=None, journal=None, publisher=None, history=None,
+                               full_crawl=True):
+    """With a journal, every call also fetches the profile and records the user's activity through it.
+
+    With a publisher, every fetched bazaar is also sent to a running query_service.py, and with a history
+    (a BazaarHistory) every crawl of an owner is added to it. full_crawl is False when user_ids are only
+    some of the owners, whose listings then replace theirs alone.
+    """
+    cache = ResponseCache()
+
+    # Listings kept by an interrupted run go back into the snapshot, and only the unfinished ranges are fetched
+    for player_id, item_name, price, quantity in checkpoint.committed_rows():
+        snapshot.add(player_id, item_name, price, quantity)
+    for user_id in checkpoint.committed_ids(user_ids):
+        snapshot.reach(user_id)  # Including those found empty or gone, who have no rows
+    user_ids = checkpoint.resume(user_ids)
+
+    if journal is None:
+        fetch = fetch_bazaar
+
+        def record(user_id, bazaar_data):
+            record_bazaar(user_id, bazaar_data, checkpoint, snapshot, alerter, publisher, history)
+    else:
+        fetch = fetch_fused
+
+        def record(user_id, result):
+            record_fused(user_id, result, checkpoint, snapshot, alerter, journal, publisher, history)
+
+    if coordinate_address is None:
+        # Every key pulls the next user from one shared queue until all bazaars are fetched
+        KeyPool(api_keys, cache).run(
+            user_ids,
+            lambda user_id, api_key: record(user_id, fetch(user_id, api_key)),
+            checkpoint.finished
+        )
+    else:
+        # Worker processes send back raw bazaars; deals are checked here as each leased chunk comes in
+        def merge(user_id, result, worker, ok):
+            if ok:
+                record(user_id, result)
+            checkpoint.finish(user_id, worker, ok)
+
+        coordinator.coordinate(user_ids, merge, coordinate_address, api_keys, fetch, cache)
+    checkpoint.close()
+    if journal is not None:
+        journal.close()  # Flush the index and re-export the blacklist and recently_checked CSVs
+    # Only what changed since the last crawl is stored, with a full keyframe every KEYFRAME_EVERY crawls.
+    # An older CSV of the listings can stand in for a missing keyframe, unless this crawl is writing it.
+    seed_csv = os.path.splitext(snapshot_path)[0] + '.csv'
+    bazaar_deltas.write_crawl(snapshot, snapshot_path,
+                              complete=full_crawl and not os.path.exists(checkpoint.log_path),
+                              seed_csv=None if seed_csv == checkpoint.output_path else seed_csv)
+    cache.report()
+    cache.close()
 
 
 # Main function to run the entire process
 def main():
     input_csv = 'active_users_filtered.csv'  # The input CSV with user IDs
+    output_snapshot = 'sorted_bazaars.bzs'  # Columnar snapshot read by the profit stage
     output_csv = 'sorted_bazaars.csv'  # The output CSV with sorted bazaar data
-
-    # Create the Tkinter root window
-    root = tk.Tk()
-    root.title("Bazaar Search Progress")
-
-    # Create a progress variable
-    total_users = len(open(input_csv).readlines()) - 1  # Subtract header
-    progress_var = tk.IntVar(value=0)
-
-    # Create progress display labels
-    progress_label = tk.Label(root, text=f"Bazaars searched: 0 of {total_users}")
-    progress_label.pack()
-
-    # Function to update the label dynamically
-    def update_label():
-        progress_label.config(text=f"Bazaars searched: {progress_var.get()} of {total_users}")
-        root.after(1000, update_label)  # Refresh the label every 1 second
-
-    update_label()  # Start updating the label
+    write_csv = False  # Set to True to also write the CSV (or export it later with bazaar_snapshot.py)
+
+    parser = argparse.ArgumentParser(description="Fetch the bazaar of every active user.")
+    metrics.add_arguments(parser)
+    coordinator.add_arguments(parser)
+    parser.add_argument('--fused', action='store_true',
+                        help="fetch the profile with each bazaar and record who went inactive")
+    parser.add_argument('--query-service', metavar='URL',
+                        help="send each bazaar to the query_service.py running at URL as it is fetched")
+    parser.add_argument('--budget', type=int, metavar='N',
+                        help="only crawl the N owners whose bazaars are most likely to hold something new")
+    args = parser.parse_args()
+    metrics.start_exporters(args)
 
     # API keys
     api_keys = [
        #inpit  keys
     ]
+    if args.keys_file:
+        api_keys = load_keys(args.keys_file)
+
+    if args.worker:
+        # A worker only fetches; the coordinator keeps the snapshot, the checkpoint and the deal alerts
+        cache = ResponseCache()
+        coordinator.run_worker(args.worker, api_keys, fetch_fused if args.fused else fetch_bazaar, cache)
+        cache.report()
+        cache.close()
+        metrics.finish_exporters(args)
+        return
+
+    # Read user IDs from the existing CSV (mapped and parsed in parallel when it is large)
+    user_ids = load_ids(input_csv)
+    total_users = len(user_ids)
 
-    # Open CSV for writing data in real-time
-    with open(output_csv, 'w', newline='') as output_file:
-        writer = csv.DictWriter(output_file, fieldnames=['player_id', 'item_name', 'price', 'quantity'])
-        writer.writeheader()
-
-        # Read user IDs from the existing CSV
-        user_ids = []
-        with open(input_csv, 'r') as infile:
-            reader = csv.reader(infile)
-            next(reader)  # Skip header row
-            for row in reader:
-                user_ids.append(row[0])  # Append user ID from the CSV
-
-        # Start background processing
-        start_processing(user_ids, api_keys, writer, output_file, progress_var)
-
-        # Start Tkinter mainloop
-        root.mainloop()
+    # Listings are checkpointed per ID range so a crash resumes the crawl; the partial file is the CSV if wanted.
+    # A budgeted crawl keeps its own checkpoint, next to the owners it picked.
+    prefix = output_snapshot if args.budget is None else output_snapshot + '.budget'
+    partial_file = output_csv if write_csv and args.budget is None else prefix + '.partial'
+    checkpoint = RangeCheckpoint(prefix + '.checkpoint', partial_file, FIELDNAMES, max_age=CHECKPOINT_MAX_AGE)
+    schedule_file = prefix + '.schedule'
+
+    # Every crawl of an owner feeds its history; with a budget, the history picks who is crawled
+    history = BazaarHistory()
+    if not history.existed:
+        import_bazaar_users(history)
+    if args.budget is not None:
+        # A resumed crawl finishes the owners the interrupted one picked. They are crawled in ID order, so the
+        # checkpoint's ranges finish one after another instead of all at the end of the run.
+        if checkpoint.completed and os.path.exists(schedule_file):
+            user_ids = load_ids(schedule_file)
+        else:
+            user_ids = sorted(history.schedule(user_ids, args.budget))
+            with open(schedule_file, 'w') as file:
+                file.writelines(f"{user_id}\n" for user_id in user_ids)
+        total_users = len(user_ids)
+
+    snapshot = SnapshotWriter()
+
+    # Stream deals as bazaars arrive; items.csv is re-read whenever it changes
+    alerter = DealAlerter(SellPriceWatcher('items.csv'), [StdoutSink(), FileSink('deals.jsonl')])
+
+    # Fused runs file each user as active, inactive or blacklisted in the shared state index, like stage 2
+    journal = None
+    if args.fused:
+        journal = Journal('bazaar_journal.log', StateIndex(), {
+            BLACKLISTED: 'blacklist.csv',
+            INACTIVE: 'recently_checked.csv',
+        })
+        journal.start()
+
+    publisher = QueryServicePublisher(args.query_service) if args.query_service else None
+
+    if args.headless:
+        process_with_multiple_keys(user_ids, api_keys, checkpoint, snapshot, output_snapshot, alerter,
+                                   args.coordinate, journal, publisher, history, args.budget is None)
+    else:
+        # Start background processing; the Tk window only reads the metrics
+        thread = threading.Thread(target=process_with_multiple_keys,
+                                  args=(user_ids, api_keys, checkpoint, snapshot, output_snapshot, alerter,
+                                        args.coordinate, journal, publisher, history, args.budget is None))
+        thread.start()
+        metrics.show_progress_window("Bazaar Search Progress", lambda: [
+            f"Bazaars searched: {USERS_PROCESSED.value(stage='4')} of {total_users}"
+        ])
+        thread.join()
+    alerter.close()
+    if publisher is not None:
+        publisher.close()
+    history.save()
+    if not os.path.exists(checkpoint.log_path):
+        if partial_file != output_csv:
+            os.remove(partial_file)  # The crawl finished, so the snapshot holds everything
+        if args.budget is None:
+            # Fold the finished crawl into the running price statistics and refresh auto_items.csv
+            price_stats.update(output_snapshot)
+        else:
+            os.remove(schedule_file)
+    metrics.finish_exporters(args)
 
 
 if __name__ == "__main__":
@@ -1,68 +1,62 @@
-import csv
+import os
+
+from bazaar_deltas import read_deltas
+from bazaar_snapshot import BazaarSnapshot
+from csv_loader import load_listings, load_sell_prices
+from order_book import OrderBook
 
 
 # Function to load user input data from a CSV (containing sell prices)
 def load_user_input(user_input_csv):
-    user_sell_prices = {}
-    with open(user_input_csv, 'r') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            item_name = row['Item Name'].lower()  # Ensure matching is case-insensitive
-            sell_price = float(row['Sell Price'])
-            user_sell_prices[item_name] = sell_price
-    return user_sell_prices
+    return load_sell_prices(user_input_csv)  # Item names are lowercased so matching is case-insensitive
 
 
 # Function to cross-reference the bazaars and find the most profitable items
 def find_profitable_items(user_sell_prices, sorted_bazaars_csv):
     profitable_items = []
 
-    # Open and read the sorted_bazaars CSV
-    with open(sorted_bazaars_csv, 'r') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            item_name = row['item_name'].lower()
-            if item_name in user_sell_prices:
-                sell_price = user_sell_prices[item_name]  # User's target sell price
-                try:
-                    buy_price = float(row['price'])
-                    quantity = int(row['quantity'])
-
-                    # Filter out price-locked items at $1
-                    if buy_price <= 1:
-                        continue
-
-                    # Calculate profitability
-                    if sell_price > buy_price:
-                        profit_per_item = sell_price - buy_price
-                        total_profit = profit_per_item * quantity
-
-                        # Generate bazaar link
-                        player_id = row['player_id']
-                        bazaar_link = f"https://www.torn.com/bazaar.php?userID={player_id}"
-
-                        profitable_items.append({
-                            'player_id': player_id,
-                            'item_name': row['item_name'],
-                            'buy_price': buy_price,
-                            'sell_price': sell_price,
-                            'quantity': quantity,
-                            'total_profit': total_profit,
-                            'bazaar_link': bazaar_link
-                        })
-                except ValueError:
-                    continue  # Skip rows with conversion issues
+    # Read the sorted_bazaars CSV into typed columns (in parallel when it is large); bad rows are skipped
+    listings = load_listings(sorted_bazaars_csv)
+
+    # User's target sell price per item, looked up once per item instead of once per listing
+    sell_prices = [user_sell_prices.get(item_name.lower()) for item_name in listings.item_names]
+    columns = listings.columns
+    for player_id, item_id, buy_price, quantity in zip(columns['player_id'], columns['item_id'],
+                                                       columns['price'], columns['quantity']):
+        sell_price = sell_prices[item_id]
+
+        # Filter out price-locked items at $1
+        if sell_price is None or buy_price <= 1:
+            continue
+
+        # Calculate profitability
+        if sell_price > buy_price:
+            profit_per_item = sell_price - buy_price
+            total_profit = profit_per_item * quantity
+
+            # Generate bazaar link
+            bazaar_link = f"https://www.torn.com/bazaar.php?userID={player_id}"
+
+            profitable_items.append({
+                'player_id': player_id,
+                'item_name': listings.item_names[item_id],
+                'buy_price': float(buy_price),
+                'sell_price': sell_price,
+                'quantity': quantity,
+                'total_profit': total_profit,
+                'bazaar_link': bazaar_link
+            })
 
     return profitable_items
 
 
 # Function to sort and display the most profitable items
-def display_most_profitable(profitable_items):
+def display_most_profitable(profitable_items, limit=None):
     # Sort by total profit in descending order
     profitable_items.sort(key=lambda x: x['total_profit'], reverse=True)
 
     print(f"Most Profitable Items:")
-    for item in profitable_items:
+    for item in profitable_items[:limit]:
         print(f"{item['player_id']}, {item['item_name']}, "
               f"Buy: ${item['buy_price']}, Sell: ${item['sell_price']}, "
               f"Quantity: {item['quantity']},  Profit: {item['total_profit']:.2f}, "
@@ -72,16 +66,31 @@ def display_most_profitable(profitable_items):
 # Main function to orchestrate the process
 def main():
     user_input_csv = 'items.csv'  # CSV with user's sell prices
+    auto_sell_prices_csv = 'auto_items.csv'  # Sell prices derived from past crawls by price_stats.py
     sorted_bazaars_csv = 'sorted_bazaars.csv'  # CSV with bazaar data
+    sorted_bazaars_snapshot = 'sorted_bazaars.bzs'  # Columnar keyframe written by the bazaar crawl, plus its .delta log
+    top_k = 50  # How many of the most profitable listings to show
 
-    # Load user input data
-    user_sell_prices = load_user_input(user_input_csv)
-
-    # Find profitable items by cross-referencing the bazaar data
-    profitable_items = find_profitable_items(user_sell_prices, sorted_bazaars_csv)
+    # Load sell prices: the derived ones cover the whole market, and the user's own in items.csv win
+    user_sell_prices = {}
+    if os.path.exists(auto_sell_prices_csv):
+        user_sell_prices.update(load_user_input(auto_sell_prices_csv))
+    user_sell_prices.update(load_user_input(user_input_csv))
+
+    # Find profitable items by cross-referencing the bazaar data, preferring the snapshot when there is one
+    if os.path.exists(sorted_bazaars_snapshot):
+        # Only the target items are loaded into the order book, then a heap keeps the top listings
+        snapshot = BazaarSnapshot(sorted_bazaars_snapshot)
+        order_book = OrderBook()
+        order_book.load_snapshot(snapshot, user_sell_prices)
+        snapshot.close()
+        order_book.apply(read_deltas(sorted_bazaars_snapshot), user_sell_prices)  # Crawls since the keyframe
+        profitable_items = order_book.top_profitable(user_sell_prices, top_k)
+    else:
+        profitable_items = find_profitable_items(user_sell_prices, sorted_bazaars_csv)
 
     # Display the most profitable items
-    display_most_profitable(profitable_items)
+    display_most_profitable(profitable_items, top_k)
 
 
 if __name__ == "__main__":
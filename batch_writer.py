@@ -0,0 +1,130 @@
+import contextlib
+import csv
+import gzip
+import os
+import queue
+import threading
+import time
+
+BATCH_ROWS = 1000  # Rows written before a flush, whichever comes first
+FLUSH_SECONDS = 1.0  # Longest a queued row waits to reach the disk
+MAX_QUEUED = 10000  # Queued writes before workers wait for the writer to catch up
+BUFFER_BYTES = 1 << 16
+ERROR_POLL_SECONDS = 0.1  # How often a worker waiting on a full queue checks whether the writer thread died
+
+_STOP = object()
+
+
+# Single writer thread for one output file: workers queue rows and return at once, and only this thread
+# touches the file. Rows are flushed in batches, at least every flush_seconds, so a crash loses at most
+# that window. A path ending in .gz is written gzip-compressed. If the writer thread fails, the error is
+# raised to every worker that writes afterwards and by close.
+class BatchWriter:
+    def __init__(self, path, header=None, mode='a', batch_rows=BATCH_ROWS, flush_seconds=FLUSH_SECONDS,
+                 fsync=False, max_queued=MAX_QUEUED):
+        """Open path and start the writer thread; header is written if the file is new or empty."""
+        self.path = path
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync  # fsync every batch instead of relying on the OS to write it out
+        new = mode == 'w' or not os.path.exists(path) or os.path.getsize(path) == 0
+        if path.endswith('.gz'):
+            self.file = gzip.open(path, mode + 't', newline='')
+        else:
+            self.file = open(path, mode, newline='', buffering=BUFFER_BYTES)
+        self.writer = csv.writer(self.file)
+        if header is not None and new:
+            self.writer.writerow(header)
+        self.queue = queue.Queue(max_queued)
+        self.error = None  # Whatever stopped the writer thread
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        """Queue an item, waiting while the queue is full, unless the writer thread has died."""
+        while True:
+            if self.error is not None:
+                raise self.error
+            try:
+                self.queue.put(item, timeout=ERROR_POLL_SECONDS)
+                return
+            except queue.Full:
+                pass
+
+    def writerow(self, row):
+        self._put((self.writer.writerow, row))
+
+    def writerows(self, rows):
+        self._put((self.writer.writerows, rows))
+
+    def write(self, text):
+        """Queue raw text, e.g. a JSON line."""
+        self._put((self.file.write, text))
+
+    def after_flush(self, callback):
+        """Call callback(offset) on the writer thread once everything queued before it is flushed (and fsynced).
+
+        offset is the file size right after those writes, which is where a checkpoint may point.
+        """
+        self._put((None, callback))
+
+    def _run(self):
+        try:
+            self._write_queued()
+        except BaseException as e:
+            self.error = e
+            # Nothing queued can be written now; emptying the queue frees workers waiting on it at once
+            with contextlib.suppress(queue.Empty):
+                while True:
+                    self.queue.get_nowait()
+            with contextlib.suppress(Exception):
+                self.file.close()
+
+    def _write_queued(self):
+        written = 0
+        callbacks = []  # (callback, offset) waiting for the next flush
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None  # The oldest pending row has waited flush_seconds
+            if item is _STOP:
+                break
+            if item is not None:
+                method, argument = item
+                if method is None:
+                    self.file.flush()  # Pushes the buffer to the OS so the size is exact; no fsync yet
+                    callbacks.append((argument, os.fstat(self.file.fileno()).st_size))
+                else:
+                    method(argument)
+                    written += len(argument) if method == self.writer.writerows else 1
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_seconds
+            if written >= self.batch_rows or (deadline is not None and time.monotonic() >= deadline):
+                self._flush(callbacks)
+                written = 0
+                deadline = None
+        self._flush(callbacks)
+        self.file.close()
+
+    def _flush(self, callbacks):
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        for callback, offset in callbacks:
+            callback(offset)
+        callbacks.clear()
+
+    def close(self):
+        """Write out everything queued, run the remaining callbacks and close the file.
+
+        Raises whatever stopped the writer thread, if it failed.
+        """
+        if self.thread.is_alive():
+            with contextlib.suppress(Exception):
+                self._put(_STOP)  # If the thread dies meanwhile, its error is raised below
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,192 @@
+import collections
+import csv
+import io
+import os
+
+from bazaar_snapshot import BazaarSnapshot, import_csv
+
+# What happened to a listing between two crawls
+ADDED = 'added'
+REMOVED = 'removed'
+REPRICED = 'repriced'  # price changed (the quantity may have too)
+REQUANTIFIED = 'requantified'  # same price, different quantity
+END = 'end'  # Closes the records of one crawl; a crawl without it was interrupted and is ignored
+
+KEYFRAME_EVERY = 24  # Crawls between full snapshots
+
+
+# Function to diff one player's bazaar: old and new are lists of (item_name, price, quantity)
+def diff_bazaar(player_id, old, new):
+    """Return (op, player_id, item_name, price, quantity, old_price, old_quantity) records turning old into new.
+
+    A player can list an item more than once, so each item's listings are compared as multisets; one listing
+    out and one in for the same item becomes a reprice or requantify instead of a remove and an add.
+    """
+    records = []
+    if collections.Counter(old) == collections.Counter(new):
+        return records
+    old_items, new_items = collections.defaultdict(collections.Counter), collections.defaultdict(collections.Counter)
+    for item_name, price, quantity in old:
+        old_items[item_name][price, quantity] += 1
+    for item_name, price, quantity in new:
+        new_items[item_name][price, quantity] += 1
+    for item_name in sorted(old_items.keys() | new_items.keys()):
+        gone = list((old_items[item_name] - new_items[item_name]).elements())
+        came = list((new_items[item_name] - old_items[item_name]).elements())
+        if len(gone) == 1 and len(came) == 1:
+            (old_price, old_quantity), (price, quantity) = gone[0], came[0]
+            op = REQUANTIFIED if price == old_price else REPRICED
+            records.append((op, player_id, item_name, price, quantity, old_price, old_quantity))
+            continue
+        for price, quantity in gone:
+            records.append((REMOVED, player_id, item_name, price, quantity, None, None))
+        for price, quantity in came:
+            records.append((ADDED, player_id, item_name, price, quantity, None, None))
+    return records
+
+
+# Function to apply one record to {player_id: [(item_name, price, quantity)]}
+def apply(market, record):
+    op, player_id, item_name, price, quantity, old_price, old_quantity = record
+    listings = market.setdefault(player_id, [])
+    if op == REMOVED:
+        listings.remove((item_name, price, quantity))
+    else:
+        if op != ADDED:
+            listings.remove((item_name, old_price, old_quantity))
+        listings.append((item_name, price, quantity))
+    if not listings:
+        del market[player_id]
+
+
+# Append-only CSV of the changes since the last keyframe; its first line names the keyframe it applies to
+class DeltaLog:
+    def __init__(self, path, keyframe_path):
+        """Initialize with the log path and the snapshot (keyframe) path it belongs to."""
+        self.path = path
+        self.keyframe_path = keyframe_path
+        self.crawls = 0  # Complete crawls in the log, counted by read()
+        self.end = 0  # Byte offset after the last complete crawl
+
+    def signature(self):
+        """The keyframe's size and mtime; a new keyframe makes an old log's first line stop matching."""
+        stat = os.stat(self.keyframe_path)
+        return f"keyframe,{stat.st_size},{stat.st_mtime_ns}\n"
+
+    def read(self):
+        """Yield the records of every complete crawl since the keyframe, oldest first."""
+        self.crawls, self.end = 0, 0
+        try:
+            file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with file:
+            first = file.readline()
+            if not os.path.exists(self.keyframe_path) or first.decode('utf-8') != self.signature():
+                return  # Left over from an older keyframe
+            offset = self.end = len(first)
+            pending = []
+            for line in file:
+                offset += len(line)
+                if not line.endswith(b'\n'):
+                    break  # Torn last line
+                fields = next(csv.reader([line.decode('utf-8')]))
+                if fields[1] == END:
+                    yield from pending
+                    pending = []
+                    self.crawls += 1
+                    self.end = offset
+                    continue
+                price, quantity = int(fields[4]), int(fields[5])
+                old_price = int(fields[6]) if fields[6] else None
+                old_quantity = int(fields[7]) if fields[7] else None
+                pending.append((fields[1], int(fields[2]), fields[3], price, quantity, old_price, old_quantity))
+
+    def append(self, records):
+        """Append one crawl's records and its end marker, cutting off a crawl left half-written by a crash.
+
+        Call read() first, so the log's end is known.
+        """
+        if self.end == 0:
+            file = open(self.path, 'wb')
+            file.write(self.signature().encode('utf-8'))
+        else:
+            file = open(self.path, 'r+b')
+            file.truncate(self.end)
+            file.seek(self.end)
+        self.crawls += 1
+        with file:
+            lines = []
+            for op, player_id, item_name, price, quantity, old_price, old_quantity in records:
+                lines.append([self.crawls, op, player_id, item_name, price, quantity,
+                              '' if old_price is None else old_price, '' if old_quantity is None else old_quantity])
+            lines.append([self.crawls, END, '', '', '', '', '', ''])
+            text = io.StringIO()  # The whole crawl goes to the log in one write
+            csv.writer(text, lineterminator='\n').writerows(lines)
+            file.write(text.getvalue().encode('utf-8'))
+            file.flush()
+            os.fsync(file.fileno())
+            self.end = file.tell()
+
+
+# Function to yield the records since the keyframe at path
+def read_deltas(path='sorted_bazaars.bzs'):
+    return DeltaLog(path + '.delta', path).read()
+
+
+# Function to rebuild the current market: the keyframe with every complete crawl since applied on top
+def load_market(path='sorted_bazaars.bzs', log=None):
+    """Return {player_id: [(item_name, price, quantity)]}."""
+    market = {}
+    if os.path.exists(path):
+        snapshot = BazaarSnapshot(path)
+        for player_id, item_name, price, quantity in snapshot.rows():
+            market.setdefault(player_id, []).append((item_name, price, quantity))
+        snapshot.close()
+    for record in (log or DeltaLog(path + '.delta', path)).read():
+        apply(market, record)
+    return market
+
+
+# Function to yield (player_id, item_name, price, quantity) for every listing in the current market
+def market_rows(path='sorted_bazaars.bzs'):
+    for player_id, listings in load_market(path).items():
+        for item_name, price, quantity in listings:
+            yield player_id, item_name, price, quantity
+
+
+# Function to store a finished crawl (a SnapshotWriter) as the changes since the previous one
+def write_crawl(snapshot, path='sorted_bazaars.bzs', complete=True, keyframe_every=KEYFRAME_EVERY, seed_csv=None):
+    """Append the crawl's diff to the delta log, or write a new keyframe every keyframe_every crawls.
+
+    Players missing from a complete crawl have had their listings removed; an interrupted crawl only
+    updates the players it reached (snapshot.reached, so one found empty or gone loses their listings),
+    and never becomes a keyframe. With no keyframe yet, it is logged against seed_csv (an older
+    sorted_bazaars.csv) imported as the keyframe, or not stored at all if there is none.
+    """
+    if not complete and not os.path.exists(path):
+        if seed_csv is None or not os.path.exists(seed_csv):
+            print(f"No keyframe at {path} yet, so the incomplete crawl is not stored; a complete crawl writes one.")
+            return []
+        import_csv(seed_csv, path)
+        print(f"Imported {seed_csv} as the keyframe at {path}.")
+    log = DeltaLog(path + '.delta', path)
+    market = load_market(path, log)
+    crawl = {}
+    for player_id, item_name, price, quantity in snapshot.rows():
+        crawl.setdefault(player_id, []).append((item_name, price, quantity))
+    players = market.keys() | crawl.keys() if complete else snapshot.reached | crawl.keys()
+    records = []
+    for player_id in sorted(players):
+        records.extend(diff_bazaar(player_id, market.get(player_id, []), crawl.get(player_id, [])))
+
+    if not os.path.exists(path) or (complete and log.crawls + 1 >= keyframe_every):
+        snapshot.write(path)  # The old log no longer matches the keyframe, so it is simply dropped
+        if os.path.exists(log.path):
+            os.remove(log.path)
+        print(f"Wrote a keyframe of {len(snapshot)} listings to {path}.")
+    else:
+        log.append(records)
+        print(f"Wrote {len(records)} changes to {log.path} ({len(snapshot)} listings crawled, "
+              f"{log.crawls} crawls since the keyframe).")
+    return records
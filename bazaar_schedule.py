@@ -0,0 +1,157 @@
+import ast
+import csv
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+
+# Per-owner rates keep this much of their weight per crawl, so an owner who changes habits is followed within a few crawls
+DECAY = 0.7
+
+# What a crawl of an owner is expected to turn up: a listing under our sell price is worth PROFIT_WEIGHT bazaars that
+# merely have something in them, and a bazaar that never changes only shows what the last crawl already saw
+PROFIT_WEIGHT = 10
+MIN_YIELD = 0.05  # Anyone can start listing
+CHANGE_FLOOR = 0.05  # Sell prices move, so even an unchanged bazaar can turn into a deal
+EMPTY_BACKOFF = 0.5  # Value kept per consecutive empty crawl
+MAX_BACKOFF_STEPS = 10  # Stops at 1/1024, so every owner is still crawled now and then
+
+HOUR = 3600
+
+
+# One bazaar owner's crawl history
+class OwnerHistory:
+    def __init__(self):
+        """Initialize an owner that was never crawled."""
+        self.crawled = 0  # Unix time of the last crawl
+        self.crawls = 0
+        self.listed = 0.0  # Decayed share of crawls that found the bazaar non-empty
+        self.changed = 0.0  # ... that found it different from the crawl before
+        self.profitable = 0.0  # ... that found a listing under our sell price
+        self.empty_streak = 0  # Crawls in a row that found it empty
+        self.fingerprint = 0  # CRC of the listings last seen
+
+    def add(self, fingerprint, listed, profitable, now):
+        changed = fingerprint != self.fingerprint if self.crawls else listed
+        decay = DECAY if self.crawls else 0.0  # The first crawl is all there is to go on
+        self.listed = self.listed * decay + (1 - decay) * listed
+        self.changed = self.changed * decay + (1 - decay) * changed
+        self.profitable = self.profitable * decay + (1 - decay) * profitable
+        self.empty_streak = 0 if listed else self.empty_streak + 1
+        self.fingerprint = fingerprint
+        self.crawled = now
+        self.crawls += 1
+
+    def value(self):
+        """Expected yield of a crawl per hour since the last one, from the history alone."""
+        backoff = EMPTY_BACKOFF ** min(self.empty_streak, MAX_BACKOFF_STEPS)
+        return (MIN_YIELD + self.listed + PROFIT_WEIGHT * self.profitable) * (CHANGE_FLOOR + self.changed) * backoff
+
+    def priority(self, now):
+        """How much a crawl now is expected to find: the value times the hours since the last crawl."""
+        if not self.crawls:
+            return float('inf')  # Never looked at, so nothing is known and it goes first
+        return self.value() * max(now - self.crawled, 0) / HOUR
+
+    def to_dict(self):
+        return {'crawled': self.crawled, 'crawls': self.crawls, 'listed': self.listed, 'changed': self.changed,
+                'profitable': self.profitable, 'empty_streak': self.empty_streak, 'fingerprint': self.fingerprint}
+
+    @classmethod
+    def from_dict(cls, data):
+        owner = cls()
+        for name, value in data.items():
+            setattr(owner, name, value)
+        return owner
+
+
+# Function to fingerprint a bazaar (a list of item dictionaries) independent of listing order
+def bazaar_fingerprint(bazaar_data):
+    listings = sorted((item['name'], item['price'], item['quantity']) for item in bazaar_data)
+    return zlib.crc32(repr(listings).encode('utf-8'))
+
+
+# Crawl history of every bazaar owner, carried from crawl to crawl in a JSON file.
+# Owners worth crawling more often (their bazaars fill, change and hold deals) get a higher priority as time passes,
+# and owners whose bazaars keep coming back empty back off exponentially, so a fixed API budget is spent where the
+# deals are.
+class BazaarHistory:
+    def __init__(self, path='bazaar_history.json'):
+        """Load the history, or start empty."""
+        self.path = path
+        self.lock = threading.Lock()
+        self.owners = {}  # player_id -> OwnerHistory
+        self.existed = os.path.exists(path)
+        if self.existed:
+            with open(path, 'r') as file:
+                self.owners = {int(player_id): OwnerHistory.from_dict(data)
+                               for player_id, data in json.load(file).items()}
+
+    def record(self, player_id, bazaar_data, deals=0, now=None):
+        """Add one crawl of a bazaar (a list of item dictionaries, or None if the player is gone).
+
+        A player who is gone counts as an empty bazaar, so they back off like one; forgetting them would
+        make them never crawled, which goes first.
+        """
+        now = int(time.time()) if now is None else now
+        if bazaar_data is None:
+            bazaar_data = []
+        with self.lock:
+            owner = self.owners.get(player_id)
+            if owner is None:
+                owner = self.owners[player_id] = OwnerHistory()
+            owner.add(bazaar_fingerprint(bazaar_data), len(bazaar_data) > 0, deals > 0, now)
+
+    def priority(self, player_id, now):
+        owner = self.owners.get(player_id)
+        return float('inf') if owner is None else owner.priority(now)
+
+    def schedule(self, player_ids, budget=None, now=None):
+        """Return player_ids ordered by priority, highest first, keeping only the first budget of them."""
+        now = int(time.time()) if now is None else now
+        scored = ((self.priority(player_id, now), player_id) for player_id in player_ids)
+        if budget is not None:
+            scored = heapq.nlargest(budget, scored)
+        else:
+            scored = sorted(scored, reverse=True)
+        return [player_id for priority, player_id in scored]
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with self.lock, open(tmp_path, 'w') as file:
+            json.dump({player_id: owner.to_dict() for player_id, owner in self.owners.items()}, file)
+        os.replace(tmp_path, self.path)
+
+
+# Function to seed a fresh history from bazaar_users.csv (user ID, bazaar as a Python list), as one crawl each
+def import_bazaar_users(history, csv_file='bazaar_users.csv'):
+    try:
+        crawled = int(os.path.getmtime(csv_file))
+        with open(csv_file, 'r', errors='replace') as file:
+            for row in csv.reader(file):
+                if len(row) > 1 and row[0].isdigit():
+                    try:
+                        bazaar_data = ast.literal_eval(row[1])
+                    except (ValueError, SyntaxError):
+                        continue
+                    if isinstance(bazaar_data, list):
+                        history.record(int(row[0]), bazaar_data, now=crawled)
+    except FileNotFoundError:
+        pass
+
+
+if __name__ == "__main__":
+    # python bazaar_schedule.py [N]: the N owners a budgeted crawl would fetch now
+    bazaar_history = BazaarHistory()
+    if not bazaar_history.existed:
+        import_bazaar_users(bazaar_history)
+    current_time = int(time.time())
+    for user_id in bazaar_history.schedule(bazaar_history.owners, int(sys.argv[1]) if len(sys.argv) > 1 else 20,
+                                           current_time):
+        history_entry = bazaar_history.owners[user_id]
+        print(f"{user_id}: priority {history_entry.priority(current_time):.3g}, {history_entry.crawls} crawls, "
+              f"listed {history_entry.listed:.2f}, changed {history_entry.changed:.2f}, "
+              f"profitable {history_entry.profitable:.2f}, empty {history_entry.empty_streak} in a row")
@@ -0,0 +1,157 @@
+import array
+import bisect
+import csv
+import mmap
+import os
+import struct
+import sys
+import threading
+
+# File layout: header, item name dictionary, then one typed array per column.
+# Rows are sorted by item id and then price, so each item is one contiguous, price-ordered run.
+MAGIC = b'BZS1'
+HEADER = struct.Struct('<4sIII')  # magic, row count, item count, item dictionary size in bytes
+COLUMNS = (
+    ('price', 'Q'),  # 8-byte column first so every column stays aligned
+    ('player_id', 'I'),
+    ('item_id', 'I'),
+    ('quantity', 'I'),
+)
+
+
+def _aligned(offset):
+    return (offset + 7) & ~7
+
+
+# Collects bazaar listings column by column while the crawl runs
+class SnapshotWriter:
+    def __init__(self):
+        """Initialize empty columns and an empty item dictionary."""
+        self.item_ids = {}  # item name -> interned item id
+        self.item_names = []  # item id -> item name
+        self.columns = {name: array.array(typecode) for name, typecode in COLUMNS}
+        self.reached = set()  # Players the crawl got an answer for, including empty and missing bazaars
+        self.lock = threading.Lock()
+
+    def intern(self, item_name):
+        item_id = self.item_ids.get(item_name)
+        if item_id is None:
+            item_id = self.item_ids[item_name] = len(self.item_names)
+            self.item_names.append(item_name)
+        return item_id
+
+    def reach(self, player_id):
+        """Note that the crawl got an answer for a player, even one with nothing listed."""
+        with self.lock:
+            self.reached.add(int(player_id))
+
+    def add(self, player_id, item_name, price, quantity):
+        with self.lock:
+            self.reached.add(int(player_id))
+            self.columns['player_id'].append(int(player_id))
+            self.columns['item_id'].append(self.intern(item_name))
+            self.columns['price'].append(int(price))
+            self.columns['quantity'].append(int(quantity))
+
+    def __len__(self):
+        return len(self.columns['player_id'])
+
+    def rows(self):
+        """Yield (player_id, item_name, price, quantity) for every listing, in the order they were added."""
+        with self.lock:
+            columns = [self.columns[name][:] for name in ('player_id', 'item_id', 'price', 'quantity')]
+        item_names = self.item_names
+        for player_id, item_id, price, quantity in zip(*columns):
+            yield player_id, item_names[item_id], price, quantity
+
+    def write(self, path):
+        """Write the snapshot atomically so readers never see a half-written file."""
+        names = '\n'.join(self.item_names).encode('utf-8')
+        tmp_path = path + '.tmp'
+        with self.lock, open(tmp_path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, len(self), len(self.item_names), len(names)))
+            file.write(names)
+            file.write(bytes(_aligned(file.tell()) - file.tell()))
+            item_ids, prices = self.columns['item_id'], self.columns['price']
+            order = sorted(range(len(self)), key=lambda row: (item_ids[row], prices[row]))
+            for name, typecode in COLUMNS:
+                column = array.array(typecode, [self.columns[name][row] for row in order])
+                if sys.byteorder == 'big':  # The file is always little-endian
+                    column.byteswap()
+                column.tofile(file)
+        os.replace(tmp_path, path)
+
+
+# Read-only view of a snapshot file; the columns are memoryviews straight over the mapped file
+class BazaarSnapshot:
+    def __init__(self, path):
+        """Map the snapshot file and expose its columns without copying them."""
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.row_count, item_count, names_size = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a bazaar snapshot")
+        offset = HEADER.size
+        names = self.map[offset:offset + names_size].decode('utf-8')
+        self.item_names = names.split('\n') if item_count else []
+        self.item_ids = {item_name: item_id for item_id, item_name in enumerate(self.item_names)}
+        offset = _aligned(offset + names_size)
+        self.columns = {}
+        self.view = view = memoryview(self.map)
+        for name, typecode in COLUMNS:
+            size = self.row_count * array.array(typecode).itemsize
+            column = view[offset:offset + size]
+            if sys.byteorder == 'big':
+                column = array.array(typecode, column.tobytes())
+                column.byteswap()
+                self.columns[name] = column
+            else:
+                self.columns[name] = column.cast(typecode)
+            offset += size
+
+    def __len__(self):
+        return self.row_count
+
+    def item_range(self, item_id):
+        """Return the (start, end) rows of one item's listings, found by bisecting the sorted item_id column."""
+        item_column = self.columns['item_id']
+        return bisect.bisect_left(item_column, item_id), bisect.bisect_right(item_column, item_id)
+
+    def rows(self):
+        """Yield (player_id, item_name, price, quantity) for every listing."""
+        item_names = self.item_names
+        for player_id, item_id, price, quantity in zip(self.columns['player_id'], self.columns['item_id'],
+                                                       self.columns['price'], self.columns['quantity']):
+            yield player_id, item_names[item_id], price, quantity
+
+    def close(self):
+        for column in self.columns.values():
+            if isinstance(column, memoryview):
+                column.release()
+        self.view.release()
+        self.map.close()
+
+
+# Function to export listings in the old sorted_bazaars.csv format, sorted by item and then price
+def export_csv(rows, csv_file):
+    with open(csv_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['player_id', 'item_name', 'price', 'quantity'])
+        writer.writerows(sorted(rows, key=lambda row: (row[1], row[2])))
+
+
+# Function to convert an existing sorted_bazaars.csv into a snapshot
+def import_csv(csv_file, path):
+    from csv_loader import load_listings  # Which builds on SnapshotWriter
+    load_listings(csv_file).write(path)
+
+
+if __name__ == "__main__":
+    # python bazaar_snapshot.py sorted_bazaars.bzs sorted_bazaars.csv  -> export to CSV
+    # python bazaar_snapshot.py sorted_bazaars.csv sorted_bazaars.bzs  -> import from CSV
+    source, target = sys.argv[1], sys.argv[2]
+    if source.endswith('.csv'):
+        import_csv(source, target)
+    else:
+        from bazaar_deltas import market_rows  # The keyframe plus the changes logged since
+        export_csv(market_rows(source), target)
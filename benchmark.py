@@ -0,0 +1,173 @@
+import argparse
+import contextlib
+import csv
+import importlib
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STAGE_MODULES = {
+    '1': '1_bazaar_account_scraper',
+    '2': '2_inactivityfilter',
+    '4': '4_bazaarcall',
+}
+
+
+# Function to read the first user IDs of one of the repo's CSVs
+def first_user_ids(csv_file, count):
+    user_ids = []
+    with open(os.path.join(REPO_DIR, csv_file), 'r', errors='replace') as file:
+        for row in csv.reader(file):
+            if row and row[0].strip().isdigit():
+                user_ids.append(int(row[0]))
+                if len(user_ids) == count:
+                    break
+    return user_ids
+
+
+# Function to run one stage against the mock server inside the current (scratch) directory
+def run_stage(stage, users, api_keys, coordinate_address=None, fused=False):
+    module = importlib.import_module(STAGE_MODULES[stage])
+    if stage == '1':
+        module.process_with_multiple_keys(1, users, api_keys, coordinate_address, fused)
+    elif stage == '2':
+        from journal import Journal
+        from response_cache import ResponseCache
+        from state_index import StateIndex, LISTED, INACTIVE, BLACKLISTED
+        user_ids = first_user_ids('active_users.csv', users)
+        index = StateIndex()
+        for user_id in user_ids:
+            index.set(user_id, LISTED)
+        journal = Journal('inactivity_journal.log', index,
+                          {BLACKLISTED: 'blacklist.csv', INACTIVE: 'recently_checked.csv'})
+        journal.start()
+        module.process_with_multiple_keys(user_ids, api_keys, index, journal, ResponseCache(), coordinate_address)
+    elif stage == '4':
+        from bazaar_snapshot import SnapshotWriter
+        from checkpoint import RangeCheckpoint
+        from journal import Journal
+        from state_index import StateIndex
+        user_ids = first_user_ids('active_users_filtered.csv', users)
+        checkpoint = RangeCheckpoint('sorted_bazaars.bzs.checkpoint', 'sorted_bazaars.bzs.partial', module.FIELDNAMES)
+        journal = None
+        if fused:
+            journal = Journal('bazaar_journal.log', StateIndex())
+            journal.start()
+        module.process_with_multiple_keys(user_ids, api_keys, checkpoint, SnapshotWriter(), 'sorted_bazaars.bzs',
+                                          None, coordinate_address, journal)
+
+
+# Function to start worker processes, each with its own keys and scratch directory, for a coordinated run
+def start_workers(stage, workers, keys, calls_per_minute, url, fused=False):
+    processes = []
+    for worker in range(workers):
+        workdir = f'worker{worker}'
+        os.makedirs(workdir)
+        with open(os.path.join(workdir, 'keys.csv'), 'w') as file:
+            for i in range(keys):
+                file.write(f'bench{worker}_{i},bench{worker}_{i},{calls_per_minute}\n')
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(REPO_DIR, STAGE_MODULES[stage] + '.py'), '--worker', url,
+             '--keys-file', 'keys.csv'] + (['--fused'] if fused else []), cwd=workdir, stdout=subprocess.DEVNULL))
+    return processes
+
+
+# Function that runs in the child process: one stage, measured on its own
+def child(stage, users, keys, calls_per_minute, workers, coordinator_port, fused):
+    sys.path.insert(0, REPO_DIR)
+    from keypool import APIKey
+    api_keys = [APIKey(f'bench{i}', f'bench{i}', calls_per_minute) for i in range(keys)]
+    coordinate_address = None
+    if workers:
+        # The coordinator only hands out IDs and merges; every key runs in a worker process
+        import coordinator
+        coordinator.CHUNK_SIZE = max(10, users // (4 * workers))  # Enough leases to keep every worker busy
+        coordinate_address = str(coordinator_port)
+        processes = start_workers(stage, workers, keys, calls_per_minute, f'http://127.0.0.1:{coordinator_port}',
+                                  fused)
+        api_keys = []
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        run_stage(stage, users, api_keys, coordinate_address, fused)
+    elapsed = time.perf_counter() - wall_start
+    if workers:
+        for process in processes:
+            process.wait()
+    print(json.dumps({
+        'stage': stage,
+        'users': users,
+        'elapsed': elapsed,
+        'cpu': time.process_time() - cpu_start,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'requests_per_sec': {api_key.holder_name: api_key.call_number / elapsed for api_key in api_keys},
+        'calls': sum(api_key.call_number for api_key in api_keys),
+    }))
+
+
+# Function to wait until the mock server accepts connections
+def wait_for_port(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with contextlib.suppress(OSError), socket.create_connection(('127.0.0.1', port), timeout=1):
+            return
+        time.sleep(0.2)
+    raise RuntimeError(f"Mock server did not start on port {port}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run stages 1, 2 and 4 against mock_torn_api.py and report throughput.")
+    parser.add_argument('--stages', default='1,2,4')
+    parser.add_argument('--users', type=int, default=500, help="user IDs per stage")
+    parser.add_argument('--keys', type=int, default=4, help="keys in total, or per worker with --workers")
+    parser.add_argument('--workers', type=int, default=0, help="run the stage as coordinator with this many worker processes")
+    parser.add_argument('--calls-per-minute', type=int, default=600, help="per key, for both scraper and mock")
+    parser.add_argument('--latency-ms', type=float, default=50.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--fused', action='store_true', help="run stages 1 and 4 with their combined-selection calls")
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.stages, args.users, args.keys, args.calls_per_minute, args.workers, args.port + 1, args.fused)
+        return
+
+    server = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, 'mock_torn_api.py'), '--port', str(args.port),
+                               '--rate-limit', str(args.calls_per_minute), '--latency-ms', str(args.latency_ms),
+                               '--error-rate', str(args.error_rate)], cwd=REPO_DIR, stdout=subprocess.DEVNULL)
+    try:
+        wait_for_port(args.port)
+        env = dict(os.environ, TORN_API_BASE=f'http://127.0.0.1:{args.port}')
+        print(f"{'stage':>5} {'users':>6} {'users/s':>8} {'req/s/key':>10} {'calls/user':>10} {'cpu s':>7} "
+              f"{'peak MB':>8}")
+        for stage in args.stages.split(','):
+            with tempfile.TemporaryDirectory() as workdir:
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--child', '--stages', stage,
+                     '--users', str(args.users), '--keys', str(args.keys), '--workers', str(args.workers),
+                     '--port', str(args.port), '--calls-per-minute', str(args.calls_per_minute)]
+                    + (['--fused'] if args.fused else []),
+                    cwd=workdir, env=env, capture_output=True, text=True)
+            if output.returncode != 0:
+                print(f"Stage {stage} failed:\n{output.stderr}")
+                continue
+            result = json.loads(output.stdout.strip().splitlines()[-1])
+            rates = result['requests_per_sec']
+            per_key = f"{sum(rates.values()) / len(rates):.2f}" if rates else '-'  # Workers' keys aren't visible here
+            per_user = f"{result['calls'] / result['users']:.2f}" if rates else '-'
+            print(f"{stage:>5} {result['users']:>6} {result['users'] / result['elapsed']:>8.1f} {per_key:>10} "
+                  f"{per_user:>10} {result['cpu']:>7.2f} {result['peak_rss_mb']:>8.1f}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import csv
+import os
+import threading
+import time
+
+from batch_writer import BatchWriter, FLUSH_SECONDS
+
+# IDs per checkpointed sub-range
+CHUNK_SIZE = 1000
+
+
+# Function to write IDs as space-separated runs, e.g. [1, 2, 3, 7] -> '1-3 7'
+def format_runs(user_ids):
+    runs = []
+    for user_id in sorted(user_ids):
+        if runs and runs[-1][1] == user_id - 1:
+            runs[-1][1] = user_id
+        else:
+            runs.append([user_id, user_id])
+    return ' '.join(str(first) if first == last else f"{first}-{last}" for first, last in runs)
+
+
+# Function to read runs written by format_runs back as (first, last) pairs
+def parse_runs(text):
+    runs = []
+    for run in text.split():
+        first, _, last = run.partition('-')
+        runs.append((int(first), int(last or first)))
+    return runs
+
+
+# Durable record of the ID sub-ranges a crawl has finished, so a restart picks up where each worker stopped.
+# Rows are buffered per sub-range and only reach the output once every ID in it is done; the log then
+# records the range, the output size after its rows, the IDs it finished and the key that finished it.
+# A restart skips exactly those IDs, so an ID list that changed between runs still has its new IDs fetched.
+# Both files are written by the output's BatchWriter thread, so workers never wait on the disk, and a
+# finished range is on disk within flush_seconds.
+class RangeCheckpoint:
+    def __init__(self, log_path, output_path, header, chunk_size=CHUNK_SIZE, max_age=None, fsync=True,
+                 flush_seconds=FLUSH_SECONDS):
+        """Initialize with the checkpoint log, the CSV it guards and that CSV's header row.
+
+        A log older than max_age seconds is ignored, for crawls whose data goes stale.
+        """
+        self.log_path = log_path
+        self.output_path = output_path
+        self.header = header
+        self.chunk_size = chunk_size
+        self.fsync = fsync
+        self.flush_seconds = flush_seconds
+        self.completed = {}  # chunk start -> (first, last) runs of IDs finished by earlier runs
+        self.remaining = {}  # chunk start -> IDs not finished yet
+        self.finished_ids = {}  # chunk start -> IDs finished so far by this run
+        self.buffers = {}  # chunk start -> rows waiting for the chunk to finish
+        self.failed = set()  # Chunks with an ID the pool gave up on; redone on the next run
+        self.lock = threading.Lock()
+        offset = None
+        if max_age is None or not os.path.exists(log_path) or time.time() - os.path.getmtime(log_path) <= max_age:
+            offset = self.replay()
+        self.output = self.open_output(offset)
+        self.log = open(log_path, 'a')
+
+    def replay(self):
+        """Load the finished ranges and return the output size they account for (None if there are none)."""
+        offset = None
+        try:
+            with open(self.log_path, 'r') as file:
+                for line in file:
+                    fields = line.rstrip('\n').split(',', 4)
+                    if not line.endswith('\n') or len(fields) != 5 or not all(field.isdigit() for field in fields[:3]):
+                        continue  # A torn last line is dropped
+                    try:
+                        runs = parse_runs(fields[3])
+                    except ValueError:
+                        continue
+                    start, offset = int(fields[0]), int(fields[2])
+                    self.completed.setdefault(start, []).extend(runs)
+        except FileNotFoundError:
+            pass
+        return offset
+
+    def open_output(self, offset):
+        """Cut the output back to the last checkpoint, or start it over if there is nothing to resume."""
+        if offset is not None and os.path.exists(self.output_path) and os.path.getsize(self.output_path) >= offset:
+            os.truncate(self.output_path, offset)  # Drops rows written after the last checkpoint
+            print(f"Resuming {self.output_path}: {len(self.completed)} ranges already done.")
+        else:
+            self.completed.clear()
+            with open(self.output_path, 'w', newline='') as output:
+                csv.writer(output).writerow(self.header)
+            open(self.log_path, 'w').close()
+        return BatchWriter(self.output_path, flush_seconds=self.flush_seconds, fsync=self.fsync)
+
+    def chunk(self, user_id):
+        return user_id - user_id % self.chunk_size
+
+    def committed(self, user_id):
+        """Whether an earlier run finished this ID."""
+        return any(first <= user_id <= last for first, last in self.completed.get(self.chunk(user_id), ()))
+
+    def resume(self, user_ids):
+        """Return the IDs of user_ids (a range or a list) that no earlier run finished, in order."""
+        for user_id in user_ids:
+            if not self.committed(user_id):
+                start = self.chunk(user_id)
+                self.remaining[start] = self.remaining.get(start, 0) + 1
+        return (user_id for user_id in user_ids if not self.committed(user_id))
+
+    def committed_ids(self, user_ids):
+        """Yield the IDs of user_ids that earlier runs finished, listings or not."""
+        return (user_id for user_id in user_ids if self.committed(user_id))
+
+    def committed_rows(self):
+        """Yield the rows already in the output from earlier runs."""
+        with open(self.output_path, 'r', newline='') as file:
+            reader = csv.reader(file)
+            next(reader, None)  # Skip header row
+            yield from reader
+
+    def add(self, user_id, row):
+        """Queue an output row for the ID's range."""
+        with self.lock:
+            self.buffers.setdefault(self.chunk(user_id), []).append(row)
+
+    def finished(self, user_id, api_key, ok):
+        """KeyPool on_finished callback."""
+        self.finish(user_id, api_key.holder_name, ok)
+
+    def finish(self, user_id, worker, ok):
+        """Mark one ID done and checkpoint its range once all of the range's IDs are."""
+        start = self.chunk(user_id)
+        with self.lock:
+            if not ok:
+                self.failed.add(start)
+            self.finished_ids.setdefault(start, []).append(user_id)
+            self.remaining[start] -= 1
+            if self.remaining[start]:
+                return
+            del self.remaining[start]
+            rows = self.buffers.pop(start, [])
+            runs = format_runs(self.finished_ids.pop(start))
+            if start in self.failed:
+                return  # Its rows are fetched again next run, so none of them are written now
+            # Queued together under the lock, so the logged offset covers exactly this range and those before it
+            self.output.writerows(rows)
+            self.output.after_flush(lambda offset: self._commit(start, start + self.chunk_size, offset, runs,
+                                                                worker.replace('\n', ' ')))
+
+    def _commit(self, start, end, offset, runs, worker):
+        """Log a finished range; runs on the writer thread once its rows are on disk."""
+        self.log.write(f"{start},{end},{offset},{runs},{worker}\n")
+        self.log.flush()
+        if self.fsync:
+            os.fsync(self.log.fileno())
+        self.completed.setdefault(start, []).extend(parse_runs(runs))
+
+    def close(self):
+        """Close both files; the log is removed once nothing is left to resume, so the next run starts over."""
+        self.output.close()  # Writes and logs the ranges still queued
+        self.log.close()
+        if not self.remaining and not self.failed:
+            os.remove(self.log_path)
+        else:
+            print(f"{len(self.remaining) + len(self.failed)} ranges left for the next run to resume.")
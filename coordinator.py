@@ -0,0 +1,193 @@
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from keypool import KeyPool
+
+CHUNK_SIZE = 1000  # IDs per lease
+LEASE_MIN_SECONDS = 120
+LEASE_SLACK = 3  # A lease lasts this many times as long as the worker's keys should need for it
+WAIT_SECONDS = 5  # How long a worker waits when everything left is leased to someone else
+CONNECT_ATTEMPTS = 60  # Tries, a second apart, before a worker gives up on an unreachable coordinator
+
+
+# Function to cut any iterable of user IDs into lists of at most size IDs
+def chunked(user_ids, size):
+    iterator = iter(user_ids)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Function to split "HOST:PORT" (or just "PORT") into its parts
+def parse_address(address):
+    host, _, port = str(address).rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+# Owns the IDs of one stage and leases chunks of them to worker processes, which may run on other machines.
+# Results are merged one ID at a time, under a lock, by the same code that records them in a local run.
+class Coordinator:
+    def __init__(self, user_ids, merge, chunk_size=None):
+        """Initialize with the IDs to hand out and merge(user_id, result, worker, ok) to record each one."""
+        self.chunks = chunked(user_ids, chunk_size or CHUNK_SIZE)
+        self.merge = merge
+        self.exhausted = False
+        self.requeued = []  # Chunks whose lease ran out before the worker reported back
+        self.leases = {}  # lease id -> (deadline, worker, user IDs)
+        self.waiting = set()  # Workers told to wait that haven't been told the work is done yet
+        self.lease_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+    def lease(self, worker, calls_per_minute):
+        """Return the next chunk for a worker, {'wait': seconds} while others hold the rest, or {'done': True}."""
+        with self.lock:
+            now = time.monotonic()
+            for lease_id, (deadline, holder, user_ids) in list(self.leases.items()):
+                if deadline < now:
+                    print(f"Lease {lease_id} held by {holder} expired; handing out its {len(user_ids)} IDs again.")
+                    del self.leases[lease_id]
+                    self.requeued.append(user_ids)
+            if self.requeued:
+                user_ids = self.requeued.pop()
+            else:
+                user_ids = None if self.exhausted else next(self.chunks, None)
+            if user_ids is None:
+                self.exhausted = True
+                if self.leases:
+                    self.waiting.add(worker)
+                    return {'wait': WAIT_SECONDS}  # One of them may still expire
+                self.waiting.discard(worker)
+                self.finished.set()
+                return {'done': True}
+            lease_id = next(self.lease_ids)
+            expected = len(user_ids) * 60 / max(calls_per_minute, 1)
+            self.leases[lease_id] = (now + max(LEASE_MIN_SECONDS, LEASE_SLACK * expected), worker, user_ids)
+            return {'lease': lease_id, 'user_ids': user_ids}
+
+    def complete(self, lease_id, worker, results, failed):
+        """Merge a finished lease; IDs the worker didn't get to count as failed. Returns False for an expired lease."""
+        with self.lock:
+            lease = self.leases.pop(lease_id, None)
+            if lease is None:
+                return False  # Already handed to another worker, whose results count instead
+            reported = set()
+            for user_id, result in results:
+                self.merge(user_id, result, worker, True)
+                reported.add(user_id)
+            for user_id in lease[2]:
+                if user_id not in reported:
+                    self.merge(user_id, None, worker, False)
+            if self.exhausted and not self.leases and not self.requeued:
+                self.finished.set()
+            return True
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve POST /lease and POST /complete as JSON from a background thread."""
+        coordinator = self
+
+        class CoordinatorHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if self.path == '/lease':
+                    reply = coordinator.lease(body['worker'], body['calls_per_minute'])
+                elif self.path == '/complete':
+                    accepted = coordinator.complete(body['lease'], body['worker'], body['results'], body['failed'])
+                    reply = {'accepted': accepted}
+                else:
+                    self.send_error(404)
+                    return
+                payload = json.dumps(reply).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), CoordinatorHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+# Function to POST to the coordinator, waiting out short outages (e.g. while it restarts)
+def _post(url, payload):
+    for attempt in range(CONNECT_ATTEMPTS):
+        try:
+            response = requests.post(url, json=payload, timeout=60)
+            response.raise_for_status()
+            return response.json()
+        except requests.RequestException as e:
+            if attempt == CONNECT_ATTEMPTS - 1:
+                raise
+            if attempt == 0:
+                print(f"Coordinator not reachable ({e}); retrying.")
+            time.sleep(1)
+
+
+# Function to work through leased chunks with this process's own keys until the coordinator runs out
+def run_worker(url, api_keys, fetch, cache=None, name=None):
+    """fetch(user_id, api_key) returns the JSON-serializable result the coordinator merges for that ID."""
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    pool = KeyPool(api_keys, cache)
+    while not all(api_key.disabled for api_key in pool.api_keys):
+        try:
+            reply = _post(url.rstrip('/') + '/lease', {'worker': name, 'calls_per_minute': pool.calls_per_minute()})
+        except requests.RequestException:
+            print(f"Coordinator at {url} is gone; worker {name} stopping.")
+            return
+        if reply.get('done'):
+            break
+        if 'wait' in reply:
+            time.sleep(reply['wait'])
+            continue
+        results, failed = [], []
+        pool.run(
+            reply['user_ids'],
+            lambda user_id, api_key: results.append([user_id, fetch(user_id, api_key)]),
+            lambda user_id, api_key, ok: ok or failed.append(user_id)
+        )
+        accepted = _post(url.rstrip('/') + '/complete',
+                         {'lease': reply['lease'], 'worker': name, 'results': results, 'failed': failed})
+        if not accepted['accepted']:
+            print(f"Lease {reply['lease']} expired before it was finished; its results were discarded.")
+    print(f"Worker {name} finished.")
+
+
+# Function to run a stage as coordinator: serve its IDs until every one has been merged
+def coordinate(user_ids, merge, address, api_keys=(), fetch=None, cache=None):
+    """The coordinator's own API keys, if any, work through the same leases as one more worker."""
+    coordinator = Coordinator(user_ids, merge)
+    host, port = parse_address(address)
+    server = coordinator.serve(port, host)
+    print(f"Coordinating on http://{host}:{port}; start workers with --worker http://<this host>:{port}")
+    if api_keys:
+        local_host = '127.0.0.1' if host in ('', '0.0.0.0') else host
+        threading.Thread(target=run_worker, args=(f"http://{local_host}:{port}", api_keys, fetch, cache, 'coordinator'),
+                         daemon=True).start()
+    coordinator.finished.wait()
+    # Stay up until workers that were told to wait have heard that everything is done
+    deadline = time.monotonic() + 2 * WAIT_SECONDS
+    while coordinator.waiting and time.monotonic() < deadline:
+        time.sleep(0.1)
+    server.shutdown()
+
+
+# Function to add the shared coordinator/worker options to a stage's argument parser
+def add_arguments(parser):
+    parser.add_argument('--coordinate', metavar='[HOST:]PORT',
+                        help="hand the IDs out to --worker processes instead of fetching them all here")
+    parser.add_argument('--worker', metavar='URL', help="fetch chunks leased by the coordinator at URL")
+    parser.add_argument('--keys-file', help="CSV of key,holder_name[,calls_per_minute] to use instead of api_keys")
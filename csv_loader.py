@@ -0,0 +1,194 @@
+import array
+import csv
+import io
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from bazaar_snapshot import SnapshotWriter
+
+# Files smaller than this are parsed in this process: starting the pool would cost more than it saves
+PARALLEL_MIN_BYTES = 8 * 1024 * 1024
+CHUNKS_PER_WORKER = 4  # Smaller pieces even out workers that get slow chunks
+MAX_PIECE_BYTES = 1024 * 1024  # Parsing holds a piece as bytes, lines and Python ints at once, so keep it small
+
+
+# Function to split data into about parts pieces that each end on a line boundary
+def split_lines(data, start, parts):
+    """Return (start, end) byte offsets covering data[start:], each piece but the last ending after a newline."""
+    bounds = []
+    step = max((len(data) - start) // parts, 1)
+    while start < len(data):
+        end = data.find(b'\n', min(start + step, len(data)) - 1)
+        end = len(data) if end == -1 else end + 1
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+# Function to map a whole file read-only (None if it is empty, which can't be mapped)
+def _map_file(csv_file):
+    with open(csv_file, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+# Function to read the header fields of a CSV (empty if the file is)
+def _read_header(csv_file):
+    data = _map_file(csv_file)
+    if data is None:
+        return []
+    with data:
+        first_line = data[:data.find(b'\n') + 1 or len(data)]
+    return next(csv.reader([first_line.decode('utf-8', errors='replace')]), [])
+
+
+# Function to parse every piece of a file with parse(csv_file, start, end, *args), in parallel if it is large
+def _parse_chunks(csv_file, parse, args, skip_header=False, workers=None):
+    """Yield parse's results in file order, for pieces of at most about MAX_PIECE_BYTES.
+
+    In this process each piece is parsed only once the caller has taken the one before, so memory stays
+    at the caller's arrays plus one piece however large the file is.
+    """
+    data = _map_file(csv_file)
+    if data is None:
+        return
+    with data:
+        start = (data.find(b'\n') + 1 or len(data)) if skip_header else 0
+        workers = workers or os.cpu_count() or 1
+        pieces = max(-(-(len(data) - start) // MAX_PIECE_BYTES), 1)
+        if workers == 1 or len(data) < PARALLEL_MIN_BYTES:
+            bounds = split_lines(data, start, pieces)
+            workers = 1
+        else:
+            bounds = split_lines(data, start, max(workers * CHUNKS_PER_WORKER, pieces))
+    if workers == 1:
+        for chunk_start, chunk_end in bounds:
+            yield parse(csv_file, chunk_start, chunk_end, *args)
+        return
+    # Each worker maps the file itself, so only the parsed arrays travel back
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(parse, csv_file, chunk_start, chunk_end, *args) for chunk_start, chunk_end in bounds]
+        for future in futures:
+            yield future.result()
+
+
+def _read_text(csv_file, start, end):
+    with _map_file(csv_file) as data:
+        return data[start:end].decode('utf-8', errors='replace')
+
+
+def _parse_ints(csv_file, start, end, columns, typecode):
+    with _map_file(csv_file) as data:
+        single_column = columns == (0,) and data.find(b',', start, end) == -1
+        lines = data[start:end].split(b'\n')
+    if lines and not lines[-1].strip():
+        lines.pop()  # After the last newline
+    if lines and not lines[0].split(b',', 1)[0].strip().isdigit():
+        lines = lines[1:]  # The header
+    # Converted a whole column at a time; only a chunk with a bad row goes through the rows one by one
+    try:
+        if single_column:
+            return [array.array(typecode, map(int, lines))]
+        rows = [line.split(b',') for line in lines]
+        return [array.array(typecode, [int(row[column]) for row in rows]) for column in columns]
+    except (IndexError, ValueError, OverflowError):
+        pass
+    limit = 1 << (8 * array.array(typecode).itemsize)
+    arrays = [array.array(typecode) for _ in columns]
+    for line in lines:
+        fields = line.rstrip(b'\r').split(b',')
+        if len(fields) > max(columns) and all(fields[column].isdigit() and int(fields[column]) < limit
+                                              for column in columns):
+            for column_array, column in zip(arrays, columns):
+                column_array.append(int(fields[column]))
+    return arrays
+
+
+def _parse_listings(csv_file, start, end, fields):
+    player_field, item_field, price_field, quantity_field = fields
+    item_ids, item_names = {}, []
+    columns = {name: array.array(typecode) for name, typecode in (('player_id', 'I'), ('item_id', 'I'),
+                                                                 ('price', 'Q'), ('quantity', 'I'))}
+    player_ids, row_item_ids, prices, quantities = (columns['player_id'], columns['item_id'], columns['price'],
+                                                    columns['quantity'])
+    for row in csv.reader(io.StringIO(_read_text(csv_file, start, end))):
+        try:
+            player_id, price, quantity = int(row[player_field]), int(row[price_field]), int(row[quantity_field])
+            item_name = row[item_field]
+        except (IndexError, ValueError):
+            continue  # Skip rows with conversion issues
+        if player_id < 0 or price < 0 or quantity < 0:
+            continue
+        item_id = item_ids.get(item_name)
+        if item_id is None:
+            item_id = item_ids[item_name] = len(item_names)
+            item_names.append(item_name)
+        player_ids.append(player_id)
+        row_item_ids.append(item_id)
+        prices.append(price)
+        quantities.append(quantity)
+    return item_names, columns
+
+
+def _parse_prices(csv_file, start, end, fields):
+    name_field, price_field = fields
+    names, prices = [], array.array('d')
+    for row in csv.reader(io.StringIO(_read_text(csv_file, start, end))):
+        try:
+            price = float(row[price_field])
+            names.append(row[name_field])
+        except (IndexError, ValueError):
+            continue
+        prices.append(price)
+    return names, prices
+
+
+# Function to load whole-number columns (by position) of a CSV into typed arrays, skipping rows that aren't numbers
+def load_ints(csv_file, columns=(0,), typecode='I', workers=None):
+    """Return one array per column, in file order. The header, if any, is skipped like any other non-number row."""
+    chunks = _parse_chunks(csv_file, _parse_ints, (columns, typecode), workers=workers)
+    arrays = [array.array(typecode) for _ in columns]
+    for chunk in chunks:
+        for column_array, chunk_array in zip(arrays, chunk):
+            column_array.extend(chunk_array)
+    return arrays
+
+
+# Function to load the user IDs in the first column of a CSV (header row optional)
+def load_ids(csv_file, workers=None):
+    return load_ints(csv_file, (0,), 'I', workers)[0]
+
+
+# Function to load a sorted_bazaars.csv into the columns of a SnapshotWriter
+def load_listings(csv_file, workers=None):
+    """Each piece interns its own item names; they are renumbered here into one dictionary."""
+    header = _read_header(csv_file)
+    if not header:
+        return SnapshotWriter()
+    fields = [header.index(name) for name in ('player_id', 'item_name', 'price', 'quantity')]
+    chunks = _parse_chunks(csv_file, _parse_listings, (fields,), skip_header=True, workers=workers)
+    snapshot = SnapshotWriter()
+    for item_names, columns in chunks:
+        renumbered = [snapshot.intern(item_name) for item_name in item_names]
+        if renumbered == list(range(len(renumbered))):
+            snapshot.columns['item_id'].extend(columns['item_id'])
+        else:
+            snapshot.columns['item_id'].extend(renumbered[item_id] for item_id in columns['item_id'])
+        for name in ('player_id', 'price', 'quantity'):
+            snapshot.columns[name].extend(columns[name])
+    return snapshot
+
+
+# Function to load sell prices from an items.csv as {lowercased item name: price}
+def load_sell_prices(csv_file, workers=None):
+    header = _read_header(csv_file)
+    if not header:
+        return {}
+    fields = [header.index('Item Name'), header.index('Sell Price')]
+    chunks = _parse_chunks(csv_file, _parse_prices, (fields,), skip_header=True, workers=workers)
+    sell_prices = {}
+    for names, prices in chunks:
+        sell_prices.update(zip((name.lower() for name in names), prices))  # Ensure matching is case-insensitive
+    return sell_prices
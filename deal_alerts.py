@@ -0,0 +1,123 @@
+import importlib
+import json
+import os
+import socket
+import threading
+import time
+
+from batch_writer import BatchWriter
+from order_book import BAZAAR_LINK
+
+# load_user_input lives in the profit stage script
+load_user_input = importlib.import_module('5_profit_gui_output').load_user_input
+
+
+# Sell prices from items.csv, reloaded whenever the file changes
+class SellPriceWatcher:
+    def __init__(self, items_csv='items.csv', check_interval=1.0):
+        """Load the sell prices now and re-check the file's mtime at most every check_interval seconds."""
+        self.items_csv = items_csv
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.checked_at = 0
+        self.sell_prices = {}
+        self.reload_if_changed()
+
+    def reload_if_changed(self):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.checked_at < self.check_interval:
+                return
+            self.checked_at = now
+            try:
+                mtime = os.stat(self.items_csv).st_mtime
+            except FileNotFoundError:
+                return
+            if mtime == self.mtime:
+                return
+            try:
+                self.sell_prices = load_user_input(self.items_csv)
+            except (KeyError, ValueError) as e:
+                print(f"Could not reload {self.items_csv}, keeping the old prices: {e}")
+                return
+            self.mtime = mtime
+            print(f"Loaded {len(self.sell_prices)} sell prices from {self.items_csv}.")
+
+    def get(self):
+        self.reload_if_changed()
+        return self.sell_prices
+
+
+# Alert sinks: each takes a deal dict and delivers it somewhere
+class StdoutSink:
+    def send(self, deal):
+        print(f"DEAL {deal['player_id']}, {deal['item_name']}, Buy: ${deal['buy_price']}, "
+              f"Sell: ${deal['sell_price']}, Quantity: {deal['quantity']}, "
+              f"Profit: {deal['total_profit']:.2f}, Bazaar Link: {deal['bazaar_link']}", flush=True)
+
+
+class FileSink:
+    def __init__(self, path='deals.jsonl'):
+        """Append one JSON line per deal to path (gzip-compressed if it ends in .gz), written in batches."""
+        self.output = BatchWriter(path)
+
+    def send(self, deal):
+        self.output.write(json.dumps(deal) + '\n')
+
+    def close(self):
+        self.output.close()
+
+
+class SocketSink:
+    def __init__(self, host='127.0.0.1', port=9999):
+        """Send one JSON datagram per deal to a local UDP socket; nothing blocks if nobody is listening."""
+        self.address = (host, port)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, deal):
+        try:
+            self.socket.sendto(json.dumps(deal).encode('utf-8'), self.address)
+        except OSError:
+            pass
+
+
+# Checks every bazaar as soon as it is fetched and sends the profitable listings to the sinks
+class DealAlerter:
+    def __init__(self, watcher, sinks):
+        """Initialize with a SellPriceWatcher and a list of sinks."""
+        self.watcher = watcher
+        self.sinks = sinks
+        self.alerts = 0
+
+    def check(self, player_id, bazaar_items):
+        """Send every listing under its sell price to the sinks; returns how many there were."""
+        sell_prices = self.watcher.get()
+        found = 0
+        for item in bazaar_items:
+            sell_price = sell_prices.get(item['name'].lower())
+            buy_price = item['price']
+            # Filter out price-locked items at $1
+            if sell_price is None or buy_price <= 1 or sell_price <= buy_price:
+                continue
+            deal = {
+                'player_id': player_id,
+                'item_name': item['name'],
+                'buy_price': buy_price,
+                'sell_price': sell_price,
+                'quantity': item['quantity'],
+                'total_profit': (sell_price - buy_price) * item['quantity'],
+                'bazaar_link': BAZAAR_LINK.format(player_id=player_id),
+                'seen_at': time.time(),
+            }
+            self.alerts += 1
+            found += 1
+            for sink in self.sinks:
+                sink.send(deal)
+        return found
+
+    def close(self):
+        """Close the sinks that hold a file open."""
+        for sink in self.sinks:
+            if hasattr(sink, 'close'):
+                sink.close()
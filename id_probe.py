@@ -0,0 +1,95 @@
+import array
+import random
+
+from state_index import UNKNOWN, LISTED, ACTIVE, INACTIVE
+
+REGION_SIZE = 10000  # IDs per region that is either swept or skipped as a whole
+SAMPLE_SIZE = 50  # Random IDs probed per region before deciding
+PRIOR_WEIGHT = 50  # What earlier runs found in a region they scanned counts as this many samples
+SWEEP_DENSITY = 0.01  # Regions estimated at fewer live accounts than this are not swept
+FRONTIER_WINDOW = 50  # IDs probed at each step of the search for the highest assigned ID
+FRONTIER_MARGIN = REGION_SIZE  # Swept past that ID, for accounts created while the scan runs
+
+# Statuses that mean earlier runs found a live account (BLACKLISTED is "no such user", BANNED is ignored)
+LIVE = (LISTED, ACTIVE, INACTIVE)
+
+
+# Plans the account scan: finds where assigned IDs end, samples every region of the ID space and
+# sweeps only the regions whose samples and prior suggest they hold accounts.
+# A region is swept in full or not at all (its known and sampled accounts are still checked); calls are not
+# spread over a region in proportion to its density, which keeps every swept region complete.
+# Every probe goes through the response cache, so the sweep gets the sampled IDs without another call.
+class IDProber:
+    def __init__(self, pool, status):
+        """Initialize with a KeyPool and status(user_id, api_key) returning LISTED, BANNED or None."""
+        self.pool = pool
+        self.status = status
+        self.results = {}  # user ID -> status, for every probed ID that got an answer
+        self.calls = 0
+
+    def probe(self, user_ids):
+        user_ids = [user_id for user_id in user_ids if user_id not in self.results]
+        self.pool.run(user_ids, lambda user_id, api_key: self.results.__setitem__(
+            user_id, self.status(user_id, api_key)))
+        self.calls += len(user_ids)
+
+    def assigned(self, user_id, end_id):
+        """True if any ID in the window starting at user_id belongs to an account, banned or not."""
+        window = range(user_id, min(user_id + FRONTIER_WINDOW, end_id + 1))
+        self.probe(window)
+        return any(self.results.get(probed) is not None for probed in window)
+
+    def find_frontier(self, low, end_id):
+        """Return the last ID worth scanning: gallop up from low while windows hit, then bisect the gap."""
+        step = FRONTIER_WINDOW
+        while low + step <= end_id and self.assigned(low + step, end_id):
+            low += step
+            step *= 2
+        high = min(low + step, end_id)
+        while high - low > FRONTIER_WINDOW:
+            middle = (low + high) // 2
+            if self.assigned(middle, end_id):
+                low = middle
+            else:
+                high = middle
+        return min(high + FRONTIER_MARGIN, end_id)
+
+    def plan(self, start_id, end_id, index):
+        """Return the IDs to scan, in order, as an array.
+
+        index (the StateIndex, seeded from the old CSVs) is the prior: a region is swept when its estimated
+        density clears SWEEP_DENSITY, otherwise only its known and sampled accounts are checked again.
+        Stage 1 records nothing for IDs that don't exist, so only a region holding some status was scanned
+        before; a region never scanned has no prior, and one whose samples got no answers is swept.
+        """
+        regions = [range(max(region, start_id), min(region + REGION_SIZE, end_id + 1))
+                   for region in range(start_id - start_id % REGION_SIZE, end_id + 1, REGION_SIZE)]
+        samples = [random.Random(ids.start).sample(ids, min(SAMPLE_SIZE, len(ids))) for ids in regions]
+        self.probe(user_id for sample in samples for user_id in sample)
+
+        # The samples see past gaps in the ID space; the frontier search then finds the exact end
+        highest = max([start_id, min(index.highest_id(), end_id)] +
+                      [user_id for user_id, status in self.results.items() if status is not None])
+        last_id = self.find_frontier(highest, end_id)
+
+        plan = array.array('I')
+        swept = 0
+        for ids, sample in zip(regions, samples):
+            if ids.start > last_id:
+                break
+            answered = [self.results[user_id] for user_id in sample if user_id in self.results]
+            codes = index.status_range(ids.start, ids.stop)
+            known = sum(codes.count(code) for code in LIVE)
+            prior = PRIOR_WEIGHT if codes.count(UNKNOWN) != len(codes) else 0
+            weight = len(answered) + prior
+            density = (answered.count(LISTED) + prior * known / len(ids)) / weight if weight else 1.0
+            if density >= SWEEP_DENSITY:
+                plan.extend(range(ids.start, min(ids.stop, last_id + 1)))
+                swept += 1
+            else:
+                keep = {ids.start + offset for offset, code in enumerate(codes) if code in LIVE}
+                keep.update(user_id for user_id in sample if self.results.get(user_id) is not None)
+                plan.extend(sorted(keep))
+        print(f"Probed {self.calls} IDs: scanning up to {last_id}, sweeping {swept} of {len(regions)} regions; "
+              f"{len(plan)} IDs to check instead of {end_id - start_id + 1}.")
+        return plan
@@ -0,0 +1,102 @@
+import csv
+import os
+import queue
+import threading
+import time
+
+from csv_loader import load_ids
+
+# Function to load a snapshot CSV of user IDs (header row optional)
+def load_snapshot(csv_file):
+    user_set = set()
+    try:
+        user_set.update(load_ids(csv_file))  # Mapped and parsed in parallel when the file is large
+    except FileNotFoundError:
+        print(f"{csv_file} not found. Starting fresh.")
+    return user_set
+
+
+# Function to atomically replace a snapshot CSV with a sequence of user IDs
+def write_snapshot(user_ids, csv_file):
+    tmp_file = csv_file + '.tmp'
+    with open(tmp_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['User ID'])
+        writer.writerows([user_id] for user_id in user_ids)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_file, csv_file)  # Readers see either the old or the new snapshot, never half of one
+
+
+# Append-only journal in front of the user state index
+class Journal:
+    def __init__(self, path, index, snapshots=None, compact_every=10000, fsync=False):
+        """Initialize the journal with its log path, the StateIndex it feeds and optional {status: CSV} exports."""
+        self.path = path
+        self.index = index
+        self.snapshots = snapshots or {}
+        self.compact_every = compact_every  # Records appended before the index is flushed and the log cut
+        self.fsync = fsync  # fsync every record instead of relying on the OS to flush
+        self.pending = 0
+        self.replay()
+        self.queue = queue.Queue()
+        self.thread = None
+        self.log = None
+
+    def replay(self):
+        """Apply records left over from the last run on top of the index."""
+        try:
+            with open(self.path, 'r') as file:
+                for line in file:
+                    fields = line.strip().split(',')
+                    if len(fields) == 4 and all(field.isdigit() for field in fields):  # A torn last line is dropped
+                        status, user_id, checked, last_action = map(int, fields)
+                        self.index.set(user_id, status, checked, last_action or None)
+                        self.pending += 1
+        except FileNotFoundError:
+            pass
+
+    def start(self):
+        """Start the single writer thread."""
+        self.log = open(self.path, 'a')
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    def add(self, status, user_id, last_action=None):
+        """Queue a status change; only the writer thread touches the index and the log."""
+        self.queue.put((status, user_id, int(time.time()), last_action))
+
+    def _writer(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            status, user_id, checked, last_action = record
+            self.index.set(user_id, status, checked, last_action)
+            self.log.write(f"{status},{user_id},{checked},{last_action or 0}\n")
+            self.log.flush()
+            if self.fsync:
+                os.fsync(self.log.fileno())
+            self.pending += 1
+            if self.pending >= self.compact_every:
+                self.compact()
+        self.compact()
+        self.log.close()
+
+    def compact(self):
+        """Flush the index to disk, then truncate the log that it now contains."""
+        self.index.flush()
+        self.log.seek(0)
+        self.log.truncate()
+        self.pending = 0
+
+    def export(self):
+        """Rewrite the legacy CSV snapshots from the index."""
+        for status, csv_file in self.snapshots.items():
+            write_snapshot(self.index.ids_with_status(status), csv_file)
+
+    def close(self):
+        """Drain the queue, compact one last time, stop the writer thread and export the CSVs."""
+        self.queue.put(None)
+        self.thread.join()
+        self.export()
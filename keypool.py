@@ -0,0 +1,369 @@
+import csv
+import heapq
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from metrics import REGISTRY, API_REQUESTS, API_LATENCY
+
+# Torn API URL for user selections (comma-separated selections are allowed).
+# TORN_API_BASE points the scrapers at another server, e.g. mock_torn_api.py for benchmarks.
+API_BASE = os.environ.get('TORN_API_BASE', 'https://api.torn.com')
+USER_URL = API_BASE + "/user/{user_id}?selections={selections}&key={api_key}"
+REQUEST_TIMEOUT = (5, 30)  # Seconds to connect and between bytes; a stalled call is retried instead of hanging its key
+
+# What to do about each Torn API error code
+THROTTLED = 'throttled'  # Slow this key down and retry the user later
+TRANSIENT = 'transient'  # Retry the user later
+KEY_DEAD = 'key_dead'  # Stop using this key, hand the user to another one
+NOT_FOUND = 'not_found'  # The user really doesn't exist (or can't be looked up)
+BAD_REQUEST = 'bad_request'  # Our bug, retrying won't help
+
+ERROR_KINDS = {
+    0: TRANSIENT,  # Unknown error
+    1: KEY_DEAD,  # Key is empty
+    2: KEY_DEAD,  # Incorrect key
+    3: BAD_REQUEST,  # Wrong type
+    4: BAD_REQUEST,  # Wrong fields
+    5: THROTTLED,  # Too many requests
+    6: NOT_FOUND,  # Incorrect ID
+    7: NOT_FOUND,  # Incorrect ID-entity relation
+    8: THROTTLED,  # IP block
+    9: TRANSIENT,  # API disabled
+    10: KEY_DEAD,  # Key owner is in federal jail
+    11: TRANSIENT,  # Key change error
+    12: TRANSIENT,  # Key read error
+    13: KEY_DEAD,  # Key disabled due to owner inactivity
+    14: KEY_DEAD,  # Daily read limit reached
+    15: TRANSIENT,  # Temporary error
+    16: KEY_DEAD,  # Access level of this key is not high enough
+    17: TRANSIENT,  # Backend error
+    18: KEY_DEAD,  # API key has been paused by the owner
+}
+
+# AIMD pacing: halve a key's rate when it gets throttled (at most once per cooldown), win most of it back
+# within RECOVERY_SECONDS, then creep up slowly in case the limit has moved
+AIMD_DECREASE = 0.5
+AIMD_INCREASE = 10  # Calls per minute regained per minute of successful calls, above the recovered rate
+RECOVERY_TARGET = 0.9  # Fraction of the throttled rate won back quickly
+RECOVERY_SECONDS = 60
+MIN_CALLS_PER_MINUTE = 5
+THROTTLE_COOLDOWN = 10  # Seconds a throttled key waits before its next call
+
+# Retry queue for users whose call failed for a reason that may go away
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 2  # Seconds, doubled on every attempt
+RETRY_MAX_DELAY = 120
+
+# A queue.Queue handed to KeyPool.run is worked through live until this marker comes out of it
+END_OF_QUEUE = object()
+LIVE_POLL_SECONDS = 0.05  # How often idle workers look for new items on a live queue
+
+API_ERRORS = REGISTRY.counter('torn_api_errors_total', 'Torn API errors by key and kind.')
+WORK_RETRIES = REGISTRY.counter('work_retries_total', 'Work items put back on the retry queue, by error kind.')
+WORK_DROPPED = REGISTRY.counter('work_dropped_total', 'Work items given up on after MAX_ATTEMPTS.')
+
+
+# Raised for Torn API responses the caller should not treat as an answer
+class TornAPIError(Exception):
+    def __init__(self, kind, code=None, message='', issued=None):
+        """Initialize with the error kind and, for in-body errors, the Torn error code.
+
+        issued is the monotonic time the failed call was sent, if it got that far.
+        """
+        super().__init__(f"{kind} ({code}): {message}" if code is not None else f"{kind}: {message}")
+        self.kind = kind
+        self.code = code
+        self.issued = issued
+
+
+# Function to turn a Torn API error object into a TornAPIError
+def classify_error(error, issued=None):
+    code = error.get('code')
+    return TornAPIError(ERROR_KINDS.get(code, TRANSIENT), code, error.get('error', ''), issued)
+
+
+# Token bucket so each key spends its calls-per-minute budget without counting request latency
+class TokenBucket:
+    def __init__(self, calls_per_minute, burst=1):
+        """Initialize a bucket that refills at calls_per_minute and holds up to burst tokens."""
+        self.rate = calls_per_minute / 60
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, calls_per_minute):
+        with self.lock:
+            self.rate = calls_per_minute / 60
+
+    def pause(self, seconds):
+        """Push the next token at least this far into the future."""
+        with self.lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def acquire(self):
+        """Block until a token is available, then take it and return the monotonic time it was taken."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return now
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)  # Only sleep for the missing fraction of a token
+
+
+# APIKey class shared by every stage
+class APIKey:
+    def __init__(self, key, holder_name, calls_per_minute=60, burst=1):
+        """Initialize an API key with holder's name and calls per minute (its real limit)."""
+        self.key = key
+        self.holder_name = holder_name
+        self.calls_per_minute = calls_per_minute
+        self.rate = calls_per_minute  # Current pace, lowered while the API is throttling this key
+        self.bucket = TokenBucket(calls_per_minute, burst)
+        self.pacing_lock = threading.Lock()
+        self.last_throttle = float('-inf')  # Monotonic time the last throttle was acted on
+        self.recovered_rate = calls_per_minute  # Won back quickly after a decrease, then slowly beyond it
+        self.recovery_step = 0  # Calls per minute regained per second until recovered_rate
+        self.last_paced = time.monotonic()
+        self.succeeded = True  # Whether a call has succeeded since the last throttle
+        self.call_number = 0  # Tracks the number of calls made with this key
+        self.cache = None  # ResponseCache set by the KeyPool, if any
+        self.disabled = False  # Set when the API says this key can't be used any more
+
+    def make_request(self, url):
+        """Make the API request; the caller has already taken a token from the bucket."""
+        started = time.perf_counter()
+        try:
+            response = requests.get(url, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            API_REQUESTS.inc(key=self.holder_name, status='error')
+            raise TornAPIError(TRANSIENT, message=str(e))
+        finally:
+            API_LATENCY.observe(time.perf_counter() - started, key=self.holder_name)
+            self.call_number += 1
+        API_REQUESTS.inc(key=self.holder_name, status=response.status_code)
+        return response
+
+    def on_success(self):
+        """Win back pace for the time since the last success: fast up to recovered_rate, slowly beyond it."""
+        with self.pacing_lock:
+            now = time.monotonic()
+            elapsed, self.last_paced = now - self.last_paced, now
+            self.succeeded = True
+            if self.rate >= self.calls_per_minute:
+                return
+            if self.rate < self.recovered_rate:
+                self.rate = min(self.recovered_rate, self.rate + self.recovery_step * elapsed)
+            else:
+                self.rate += AIMD_INCREASE * elapsed / 60
+            self.rate = min(self.calls_per_minute, self.rate)
+            self.bucket.set_rate(self.rate)
+
+    def on_error(self, error):
+        API_ERRORS.inc(key=self.holder_name, kind=error.kind)
+        if error.kind == THROTTLED:
+            with self.pacing_lock:
+                now = time.monotonic()
+                if error.issued is not None and error.issued < self.last_throttle:
+                    return  # Sent before the last throttle was acted on, so already answered
+                if now - self.last_throttle < THROTTLE_COOLDOWN:
+                    return
+                if self.succeeded:
+                    # The current pace was too fast; a throttle with no success since only means the API's
+                    # window hasn't emptied yet, which waiting out another cooldown answers
+                    self.recovered_rate = self.rate * RECOVERY_TARGET
+                    self.rate = max(MIN_CALLS_PER_MINUTE, self.rate * AIMD_DECREASE)
+                    self.recovery_step = max(self.recovered_rate - self.rate, 0) / RECOVERY_SECONDS
+                    self.bucket.set_rate(self.rate)
+                self.succeeded = False
+                self.last_throttle = self.last_paced = now
+                self.bucket.pause(THROTTLE_COOLDOWN)
+        elif error.kind == KEY_DEAD:
+            self.disabled = True
+            print(f"Key of {self.holder_name} can't be used any more: {error}")
+
+    def fetch_user(self, user_id, selections):
+        """Return the JSON for a user's selections, from the cache if possible.
+
+        Returns None if the user doesn't exist and raises TornAPIError for anything worth retrying.
+        """
+        if self.cache is not None:
+            data = self.cache.get(user_id, selections)
+            if data is not None:
+                return data  # No token spent
+        issued = self.bucket.acquire()
+        response = self.make_request(USER_URL.format(user_id=user_id, selections=selections, api_key=self.key))
+        if response.status_code == 429:
+            raise TornAPIError(THROTTLED, message='HTTP 429', issued=issued)
+        if response.status_code != 200:
+            raise TornAPIError(TRANSIENT, message=f"HTTP {response.status_code}")
+        try:
+            data = response.json()
+        except ValueError:
+            raise TornAPIError(TRANSIENT, message='response is not JSON')
+        if 'error' in data:
+            error = classify_error(data['error'], issued)
+            if error.kind == NOT_FOUND:
+                self.on_success()  # The key itself is fine
+                return None
+            raise error
+        self.on_success()
+        if self.cache is not None:
+            self.cache.put(user_id, selections, data)
+        return data
+
+
+# Function to read API keys from a CSV of key,holder_name[,calls_per_minute] rows, so each machine can bring its own
+def load_keys(csv_file):
+    api_keys = []
+    with open(csv_file, 'r') as file:
+        for row in csv.reader(file):
+            if len(row) >= 2 and not row[0].startswith('#'):
+                calls_per_minute = int(row[2]) if len(row) > 2 and row[2].strip().isdigit() else 60
+                api_keys.append(APIKey(row[0].strip(), row[1].strip(), calls_per_minute))
+    return api_keys
+
+
+# Shared work queue that every key pulls from, with a delayed retry queue in front of it
+class WorkQueue:
+    def __init__(self, items):
+        """Wrap any iterable (list, range, generator) so several threads can pull from it.
+
+        items can also be a queue.Queue another stage is still filling, closed by putting END_OF_QUEUE.
+        """
+        self.live = isinstance(items, queue.Queue)
+        self.items = items if self.live else iter(items)
+        self.exhausted = False
+        self.retries = []  # Heap of (ready time, sequence, item)
+        self.sequence = itertools.count()
+        self.attempts = {}
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def get(self):
+        """Return the next item, or None once nothing is left and nothing in flight can come back."""
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if self.retries and self.retries[0][0] <= now:
+                    item = heapq.heappop(self.retries)[2]
+                    break
+                if not self.exhausted:
+                    item = self._next()
+                    if item is not None:
+                        break
+                if self.exhausted and not self.retries and self.in_flight == 0:
+                    return None
+                # Wait for a retry to become due or for an in-flight item to finish (or a live queue to fill)
+                timeout = self.retries[0][0] - now if self.retries else None
+                if not self.exhausted:
+                    timeout = LIVE_POLL_SECONDS if timeout is None else min(timeout, LIVE_POLL_SECONDS)
+                self.condition.wait(timeout)
+            self.in_flight += 1
+            return item
+
+    def _next(self):
+        """Return the next new item, or None if there is none right now; sets exhausted once none can come."""
+        if not self.live:
+            item = next(self.items, None)
+            self.exhausted = item is None
+            return item
+        try:
+            item = self.items.get_nowait()
+        except queue.Empty:
+            return None
+        if item is END_OF_QUEUE:
+            self.exhausted = True
+            return None
+        return item
+
+    def done(self, item):
+        with self.condition:
+            self.in_flight -= 1
+            self.attempts.pop(item, None)
+            self.condition.notify_all()
+
+    def retry(self, item):
+        """Put an item back after a backoff delay; returns False once it has used up its attempts."""
+        with self.condition:
+            self.in_flight -= 1
+            attempts = self.attempts.get(item, 0) + 1
+            if attempts >= MAX_ATTEMPTS:
+                self.attempts.pop(item, None)
+                self.condition.notify_all()
+                return False
+            self.attempts[item] = attempts
+            delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+            heapq.heappush(self.retries, (time.monotonic() + delay, next(self.sequence), item))
+            self.condition.notify_all()
+            return True
+
+
+# Pool of API keys that work through a single queue
+class KeyPool:
+    def __init__(self, api_keys, cache=None):
+        """Initialize the pool with a list of APIKey objects and an optional ResponseCache they all consult."""
+        self.api_keys = list(api_keys)
+        self.cache = cache
+        self.dropped = []  # Items that still failed after MAX_ATTEMPTS
+        for api_key in self.api_keys:
+            api_key.cache = cache
+
+    def calls_per_minute(self):
+        """Aggregate rate budget of every key in the pool."""
+        return sum(api_key.calls_per_minute for api_key in self.api_keys)
+
+    def _worker(self, work, handler, api_key, on_finished):
+        while not api_key.disabled:
+            item = work.get()
+            if item is None:
+                return
+            ok = False
+            try:
+                handler(item, api_key)
+                ok = True
+            except TornAPIError as e:
+                api_key.on_error(e)
+                if e.kind != BAD_REQUEST and work.retry(item):
+                    WORK_RETRIES.inc(kind=e.kind)
+                    continue
+                if e.kind == BAD_REQUEST:
+                    work.done(item)
+                self.dropped.append(item)
+                WORK_DROPPED.inc()
+                print(f"Giving up on {item}: {e}")
+            except Exception as e:
+                print(f"Error processing {item} with key holder {api_key.holder_name}: {e}")
+                work.done(item)
+            else:
+                work.done(item)
+            if on_finished is not None:
+                on_finished(item, api_key, ok)
+
+    def run(self, items, handler, on_finished=None):
+        """Call handler(item, api_key) for every item, each key pulling the next item as soon as it is free.
+
+        Items whose call fails with a throttling, transient or dead-key error go back on a retry queue
+        with exponential backoff instead of being dropped. on_finished(item, api_key, ok) is called once
+        per item when it is done for good, with ok False if it was given up on.
+        """
+        if not self.api_keys:
+            print("No API keys configured.")
+            return
+        work = WorkQueue(items)
+        with ThreadPoolExecutor(max_workers=len(self.api_keys)) as executor:
+            futures = [executor.submit(self._worker, work, handler, api_key, on_finished) for api_key in self.api_keys]
+            for future in futures:
+                future.result()
+        if all(api_key.disabled for api_key in self.api_keys):
+            print("Every API key has been disabled; the remaining work was not done.")
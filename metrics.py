@@ -0,0 +1,200 @@
+import bisect
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Default latency buckets in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+# Monotonic counter with optional labels
+class Counter:
+    def __init__(self, name, help_text):
+        """Initialize a counter; each distinct set of labels gets its own value."""
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Sum of every series whose labels include the given ones."""
+        wanted = set(_label_key(labels))
+        with self.lock:
+            return sum(value for key, value in self.values.items() if wanted <= set(key))
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+# Cumulative histogram with optional labels
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        """Initialize a histogram with the given upper bucket bounds."""
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 2)
+            series[position] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-1]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+# Holds every metric of the process and exports them in the Prometheus text format
+class Registry:
+    def __init__(self):
+        """Initialize an empty registry."""
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get_or_create(self, name, factory):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = factory()
+            return self.metrics[name]
+
+    def counter(self, name, help_text):
+        return self._get_or_create(name, lambda: Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._get_or_create(name, lambda: Histogram(name, help_text, buckets))
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Atomically write the metrics, e.g. for node_exporter's textfile collector."""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write(self.render())
+        os.replace(tmp_path, path)
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve the metrics at http://host:port/metrics from a background thread."""
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                payload = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+# Process-wide registry every module reports into
+REGISTRY = Registry()
+
+# Metrics shared by the stages
+API_REQUESTS = REGISTRY.counter('torn_api_requests_total', 'Torn API calls by key and HTTP status.')
+API_LATENCY = REGISTRY.histogram('torn_api_request_seconds', 'Torn API request latency by key.')
+USERS_PROCESSED = REGISTRY.counter('users_processed_total', 'Users handled by each stage, by outcome.')
+LISTINGS_SEEN = REGISTRY.counter('bazaar_listings_total', 'Bazaar listings recorded by the crawl.')
+
+
+# Function to keep a metrics text file up to date from a background thread
+def start_textfile_exporter(path, interval=10, registry=REGISTRY):
+    def export():
+        while True:
+            registry.write_textfile(path)
+            time.sleep(interval)
+
+    threading.Thread(target=export, daemon=True).start()
+
+
+# Function to add the shared headless/metrics options to a stage's argument parser
+def add_arguments(parser, gui=True):
+    if gui:
+        parser.add_argument('--headless', action='store_true', help="run without the Tk progress window")
+    parser.add_argument('--metrics-file', help="keep a Prometheus text file of the metrics up to date")
+    parser.add_argument('--metrics-port', type=int, help="serve the metrics on http://127.0.0.1:PORT/metrics")
+
+
+# Function to start whichever exporters the options asked for
+def start_exporters(args):
+    if args.metrics_file:
+        start_textfile_exporter(args.metrics_file)
+    if args.metrics_port:
+        REGISTRY.serve(args.metrics_port)
+
+
+# Function to write the final values once a stage is done
+def finish_exporters(args):
+    if args.metrics_file:
+        REGISTRY.write_textfile(args.metrics_file)
+
+
+# Function to show a small Tk window whose labels are refreshed from the metrics
+def show_progress_window(title, describe, interval_ms=1000):
+    """describe() returns the label texts; Tk is only imported here so headless runs never need it."""
+    import tkinter as tk
+
+    root = tk.Tk()
+    root.title(title)
+    labels = []
+    for text in describe():
+        label = tk.Label(root, text=text)
+        label.pack()
+        labels.append(label)
+
+    def update_labels():
+        for label, text in zip(labels, describe()):
+            label.config(text=text)
+        root.after(interval_ms, update_labels)
+
+    root.after(interval_ms, update_labels)
+    root.mainloop()
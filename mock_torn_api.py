@@ -0,0 +1,232 @@
+import argparse
+import ast
+import collections
+import csv
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Torn API error codes the mock can return
+ERROR_MESSAGES = {
+    2: 'Incorrect Key',
+    4: 'Wrong fields',
+    5: 'Too many requests',
+    6: 'Incorrect ID',
+    15: 'Temporary error',
+    17: 'Backend error occurred, please try again',
+    18: 'API key paused by owner',
+}
+
+
+# Function to read the first column of a CSV as ints (header optional)
+def read_ids(csv_file):
+    user_ids = set()
+    try:
+        with open(csv_file, 'r', errors='replace') as file:
+            for row in csv.reader(file):
+                if row and row[0].isdigit():
+                    user_ids.add(int(row[0]))
+    except FileNotFoundError:
+        pass
+    return user_ids
+
+
+# Users, last actions and bazaars seeded from the CSVs the real scrapers produced
+class MockData:
+    def __init__(self):
+        """Load the existing CSVs so responses look like what the real API gave us."""
+        self.now = int(time.time())
+        self.listed = read_ids('active_users.csv')
+        self.blacklist = read_ids('blacklist.csv')
+        self.inactive = read_ids('recently_checked.csv')
+        self.last_actions = {}
+        try:
+            with open('active_users_filtered.csv', 'r', errors='replace') as file:
+                for row in csv.reader(file):
+                    if len(row) > 1 and row[0].isdigit() and row[1].isdigit():
+                        self.last_actions[int(row[0])] = int(row[1])
+        except FileNotFoundError:
+            pass
+        if self.last_actions:
+            # The CSV's timestamps are as old as the run that wrote them; shifting its newest to now keeps the gaps
+            # between users without making every one of them look inactive
+            shift = self.now - max(self.last_actions.values())
+            self.last_actions = {user_id: timestamp + shift for user_id, timestamp in self.last_actions.items()}
+        self.bazaars = {}
+        self.load_bazaars()
+
+    def load_bazaars(self):
+        try:
+            with open('bazaar_users.csv', 'r', errors='replace') as file:
+                for row in csv.reader(file):
+                    if len(row) > 1 and row[0].isdigit():
+                        self.bazaars[int(row[0])] = ast.literal_eval(row[1])
+        except (FileNotFoundError, ValueError, SyntaxError):
+            pass
+        # Fill in owners that only appear in the flat crawl output
+        seeded = set(self.bazaars)
+        try:
+            with open('sorted_bazaars.csv', 'r', errors='replace') as file:
+                for row in csv.DictReader(file):
+                    player_id = int(row['player_id'])
+                    if player_id in seeded:
+                        continue
+                    items = self.bazaars.setdefault(player_id, [])
+                    if any(item['name'] == row['item_name'] for item in items):
+                        continue
+                    items.append({'ID': zlib.crc32(row['item_name'].encode('utf-8')) % 1500,
+                                  'name': row['item_name'], 'type': 'Other', 'quantity': int(row['quantity']),
+                                  'price': int(row['price']), 'market_price': int(row['price'])})
+        except FileNotFoundError:
+            pass
+
+    def exists(self, user_id):
+        return user_id not in self.blacklist and (
+            user_id in self.listed or user_id in self.last_actions or user_id in self.inactive
+            or user_id in self.bazaars)
+
+    def last_action(self, user_id):
+        if user_id in self.last_actions:
+            return self.last_actions[user_id]
+        if user_id in self.inactive:
+            # Somewhere between 41 days and 4 years ago, stable per user
+            return self.now - (41 + user_id % 1420) * 86400
+        return self.now - (user_id % 30) * 86400
+
+    def selection(self, user_id, selection):
+        """Return the fields for one selection, or an error code."""
+        if selection == 'publicStatus':
+            if user_id in self.blacklist:
+                return {'playerID': user_id, 'banned': True}
+            if not self.exists(user_id):
+                return 6
+            return {'playerID': user_id, 'status': 'Okay', 'banned': False}
+        if not self.exists(user_id):
+            return 6
+        if selection == 'profile':
+            timestamp = self.last_action(user_id)
+            return {
+                'player_id': user_id,
+                'name': f'Player{user_id}',
+                'level': 1 + user_id % 100,
+                'status': {'description': 'Okay', 'state': 'Okay', 'color': 'green', 'until': 0},
+                'last_action': {'status': 'Offline', 'timestamp': timestamp,
+                                'relative': f'{(self.now - timestamp) // 86400} days ago'},
+            }
+        if selection == 'bazaar':
+            return {'bazaar': self.bazaars.get(user_id, [])}
+        return 4
+
+
+# Per-key sliding-window rate limiter, latency and fault injection
+class MockBehaviour:
+    def __init__(self, rate_limit=100, latency_ms=150.0, latency_sigma=0.5, error_rate=0.0,
+                 http_error_rate=0.0, paused_keys=(), seed=1):
+        """rate_limit is calls per minute per key; latency is lognormal around latency_ms."""
+        self.rate_limit = rate_limit
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.http_error_rate = http_error_rate
+        self.paused_keys = set(paused_keys)
+        self.random = random.Random(seed)
+        self.calls = collections.defaultdict(collections.deque)
+        self.lock = threading.Lock()
+
+    def latency(self):
+        with self.lock:
+            return self.random.lognormvariate(math.log(self.latency_ms / 1000), self.latency_sigma)
+
+    def admit(self, key):
+        """Return None if the call may go ahead, otherwise an HTTP status or a Torn error code."""
+        now = time.monotonic()
+        with self.lock:
+            if key in self.paused_keys:
+                return 18
+            calls = self.calls[key]
+            while calls and now - calls[0] > 60:
+                calls.popleft()
+            if len(calls) >= self.rate_limit:
+                return 5
+            calls.append(now)
+            roll = self.random.random()
+        if roll < self.http_error_rate:
+            return 502
+        if roll < self.http_error_rate + self.error_rate:
+            return 17
+        return None
+
+
+def make_handler(data, behaviour):
+    class TornHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            parts = url.path.strip('/').split('/')
+            time.sleep(behaviour.latency())
+            if len(parts) != 2 or parts[0] != 'user' or not parts[1].isdigit():
+                return self.reply(404, {})
+            key = query.get('key', [''])[0]
+            if not key:
+                return self.reply(200, self.error(2))
+            verdict = behaviour.admit(key)
+            if verdict is not None:
+                return self.reply(verdict, {}) if verdict >= 500 else self.reply(200, self.error(verdict))
+            user_id = int(parts[1])
+            body = {}
+            for selection in query.get('selections', [''])[0].split(','):
+                fields = data.selection(user_id, selection)
+                if isinstance(fields, int):
+                    return self.reply(200, self.error(fields))
+                body.update(fields)
+            self.reply(200, body)
+
+        def error(self, code):
+            return {'error': {'code': code, 'error': ERROR_MESSAGES.get(code, 'Unknown error')}}
+
+        def reply(self, status, body):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass  # One line per request would drown the benchmark output
+
+    return TornHandler
+
+
+# Function to start the mock server in a background thread
+def start_server(port=8099, **behaviour_options):
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(MockData(), MockBehaviour(**behaviour_options)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for api.torn.com, seeded from the CSVs in this folder.")
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--rate-limit', type=int, default=100, help="calls per minute per key")
+    parser.add_argument('--latency-ms', type=float, default=150.0, help="median response latency")
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help="lognormal spread of the latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of calls answered with a backend error")
+    parser.add_argument('--http-error-rate', type=float, default=0.0, help="fraction of calls answered with HTTP 502")
+    parser.add_argument('--paused-keys', nargs='*', default=[])
+    args = parser.parse_args()
+
+    server = start_server(args.port, rate_limit=args.rate_limit, latency_ms=args.latency_ms,
+                          latency_sigma=args.latency_sigma, error_rate=args.error_rate,
+                          http_error_rate=args.http_error_rate, paused_keys=args.paused_keys)
+    print(f"Mock Torn API listening on http://127.0.0.1:{args.port}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
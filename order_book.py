@@ -0,0 +1,135 @@
+import bisect
+import heapq
+
+from bazaar_deltas import ADDED, REMOVED
+
+BAZAAR_LINK = "https://www.torn.com/bazaar.php?userID={player_id}"
+
+
+# Listings for one item, kept sorted by price
+class ItemBook:
+    def __init__(self, item_name):
+        """Initialize an empty book; prices and listings are parallel lists."""
+        self.item_name = item_name
+        self.prices = []
+        self.listings = []  # (price, player_id, quantity)
+
+    def add(self, player_id, price, quantity):
+        position = bisect.bisect_right(self.prices, price)
+        self.prices.insert(position, price)
+        self.listings.insert(position, (price, player_id, quantity))
+
+    def remove(self, player_id, price, quantity):
+        """Remove one listing of a player at a price and quantity, if it is in the book.
+
+        The quantity matters: a player can list the same item more than once at the same price.
+        """
+        start = bisect.bisect_left(self.prices, price)
+        end = bisect.bisect_right(self.prices, price)
+        for position in range(start, end):
+            if self.listings[position][1:] == (player_id, quantity):
+                del self.prices[position]
+                del self.listings[position]
+                return True
+        return False
+
+    def cheapest(self, n, min_price=1):
+        """The n cheapest listings priced above min_price."""
+        start = bisect.bisect_right(self.prices, min_price)
+        return self.listings[start:start + n]
+
+    def between(self, min_price, max_price):
+        """Listings priced above min_price and below max_price, cheapest first."""
+        start = bisect.bisect_right(self.prices, min_price)
+        end = bisect.bisect_left(self.prices, max_price)
+        return self.listings[start:end]
+
+
+# In-memory order book: listings grouped by item (lowercase name), sorted by price
+class OrderBook:
+    def __init__(self):
+        """Initialize an empty order book."""
+        self.items = {}
+
+    def add(self, player_id, item_name, price, quantity):
+        key = item_name.lower()
+        book = self.items.get(key)
+        if book is None:
+            book = self.items[key] = ItemBook(item_name)
+        book.add(player_id, price, quantity)
+
+    def remove(self, player_id, item_name, price, quantity):
+        book = self.items.get(item_name.lower())
+        return book is not None and book.remove(player_id, price, quantity)
+
+    def load_snapshot(self, snapshot, item_names=None):
+        """Load a BazaarSnapshot, only for the given lowercase item names if any are given.
+
+        Snapshot rows are already sorted by item and price, so each item is a single slice of the columns.
+        """
+        columns = snapshot.columns
+        for item_id, item_name in enumerate(snapshot.item_names):
+            key = item_name.lower()
+            if item_names is not None and key not in item_names:
+                continue
+            start, end = snapshot.item_range(item_id)
+            book = self.items.get(key)
+            if book is None:
+                book = self.items[key] = ItemBook(item_name)
+            prices = columns['price'][start:end].tolist()
+            listings = list(zip(prices, columns['player_id'][start:end].tolist(),
+                                columns['quantity'][start:end].tolist()))
+            if book.prices:
+                for price, player_id, quantity in listings:
+                    book.add(player_id, price, quantity)
+            else:
+                book.prices, book.listings = prices, listings
+
+    def load_rows(self, rows):
+        """Load (player_id, item_name, price, quantity) rows in any order, sorting each item's listings once."""
+        grouped = {}
+        for player_id, item_name, price, quantity in rows:
+            grouped.setdefault(item_name, []).append((price, player_id, quantity))
+        for item_name, listings in grouped.items():
+            book = self.items.get(item_name.lower())
+            if book is None:
+                book = self.items[item_name.lower()] = ItemBook(item_name)
+                listings.sort()
+                book.prices, book.listings = [listing[0] for listing in listings], listings
+            else:
+                for price, player_id, quantity in listings:
+                    book.add(player_id, price, quantity)
+
+    def apply(self, records, item_names=None):
+        """Apply delta records from bazaar_deltas in order, only for the given lowercase item names if any."""
+        for op, player_id, item_name, price, quantity, old_price, old_quantity in records:
+            if item_names is not None and item_name.lower() not in item_names:
+                continue
+            if op == REMOVED:
+                self.remove(player_id, item_name, price, quantity)
+                continue
+            if op != ADDED:
+                self.remove(player_id, item_name, old_price, old_quantity)
+            self.add(player_id, item_name, price, quantity)
+
+    def top_profitable(self, user_sell_prices, k=50):
+        """Return the k most profitable listings, only walking the listings priced below each sell price."""
+        def candidates():
+            for item_name, sell_price in user_sell_prices.items():
+                book = self.items.get(item_name)
+                if book is None:
+                    continue
+                # Filter out price-locked items at $1
+                for buy_price, player_id, quantity in book.between(1, sell_price):
+                    yield (sell_price - buy_price) * quantity, buy_price, player_id, quantity, book, sell_price
+
+        return [{
+            'player_id': player_id,
+            'item_name': book.item_name,
+            'buy_price': buy_price,
+            'sell_price': sell_price,
+            'quantity': quantity,
+            'total_profit': total_profit,
+            'bazaar_link': BAZAAR_LINK.format(player_id=player_id)
+        } for total_profit, buy_price, player_id, quantity, book, sell_price
+            in heapq.nlargest(k, candidates(), key=lambda candidate: candidate[0])]
@@ -0,0 +1,222 @@
+import argparse
+import importlib
+import queue
+import threading
+import time
+
+from batch_writer import BatchWriter
+import bazaar_deltas
+from bazaar_schedule import BazaarHistory, import_bazaar_users
+from bazaar_snapshot import SnapshotWriter
+from checkpoint import RangeCheckpoint
+from deal_alerts import DealAlerter, StdoutSink, FileSink
+from id_probe import IDProber
+from journal import Journal
+import metrics
+from keypool import KeyPool, END_OF_QUEUE, load_keys
+from metrics import USERS_PROCESSED
+from query_service import QueryServicePublisher, SellPrices
+from recheck import recheck_score
+from response_cache import ResponseCache
+from state_index import StateIndex, LISTED, ACTIVE, INACTIVE, BLACKLISTED
+
+# The numbered stage scripts can't be imported by name
+scraper = importlib.import_module('1_bazaar_account_scraper')
+inactivity_filter = importlib.import_module('2_inactivityfilter')
+bazaar_call = importlib.import_module('4_bazaarcall')
+
+QUEUE_SIZE = 1000  # Users waiting between two stages before the stage upstream has to wait
+PROGRESS_SECONDS = 10
+
+
+# Runs account discovery, the inactivity filter, the bazaar fetch and deal evaluation at once, each user
+# moving on to the next stage as soon as it is through the last. The API stages share the same keys (so
+# their rate limits and pacing are shared too) and hand users on through bounded queues: a full queue
+# holds up the stage feeding it, so discovery never runs further ahead than the bazaar fetch can follow.
+class Pipeline:
+    def __init__(self, api_keys, cache, index, journal, alerter, publisher=None, fused=False, queue_size=QUEUE_SIZE,
+                 history=None):
+        """Initialize with the keys, the shared cache, state index and journal, and the deal alerter."""
+        self.api_keys = api_keys
+        self.cache = cache
+        self.index = index
+        self.journal = journal
+        self.alerter = alerter
+        self.publisher = publisher
+        self.fused = fused
+        self.history = history
+        self.to_filter = queue.Queue(queue_size)  # Discovered users whose activity has to be checked
+        self.to_fetch = queue.Queue(queue_size)  # Active users whose bazaar has to be fetched
+        self.to_evaluate = queue.Queue(queue_size)  # Fetched bazaars
+        self.stop = threading.Event()
+        self.started = time.monotonic()
+        self.first_deal = None
+        self.snapshot = SnapshotWriter()
+
+    def route(self, user_id):
+        """Send a listed user on: skip the profile call while the index still vouches for its status."""
+        status = self.index.status(user_id)
+        if status in (ACTIVE, INACTIVE):
+            due = recheck_score(status, self.index.checked(user_id), self.index.last_action(user_id),
+                                int(time.time())) > 0
+            if not due:
+                if status == ACTIVE:
+                    self.to_fetch.put(user_id)
+                return
+        self.to_filter.put(user_id)
+
+    def discover(self, user_ids, checkpoint):
+        def check(user_id, api_key):
+            if self.fused:
+                result = scraper.fused_status(user_id, api_key)
+                scraper.record_fused_status(user_id, result, checkpoint, self.index)
+                if result[0] == LISTED and self.index.status(user_id) == ACTIVE:
+                    self.to_fetch.put(user_id)  # The profile came with it, so the filter has nothing to add
+                return
+            status = scraper.public_status(user_id, api_key)
+            scraper.record_public_status(user_id, status, checkpoint, self.index)
+            if status == LISTED:
+                self.route(user_id)
+
+        def until_stopped():
+            for user_id in user_ids:
+                if self.stop.is_set():
+                    return
+                yield user_id
+
+        KeyPool(self.api_keys, self.cache).run(until_stopped(), check, checkpoint.finished)
+        checkpoint.close()
+        self.to_filter.put(END_OF_QUEUE)
+
+    def filter(self, output):
+        def check(user_id, api_key):
+            last_action = inactivity_filter.fetch_last_action(user_id, api_key)
+            inactivity_filter.record_user(user_id, last_action, output, self.index, self.journal)
+            if last_action is not None and inactivity_filter.is_active(last_action):
+                self.to_fetch.put(user_id)
+
+        KeyPool(self.api_keys, self.cache).run(self.to_filter, check)
+        self._drain(self.to_filter)
+        self.to_fetch.put(END_OF_QUEUE)
+
+    def fetch(self):
+        KeyPool(self.api_keys, self.cache).run(
+            self.to_fetch,
+            lambda user_id, api_key: self.to_evaluate.put((user_id, bazaar_call.fetch_bazaar(user_id, api_key)))
+        )
+        self._drain(self.to_fetch)
+        self.to_evaluate.put(END_OF_QUEUE)
+
+    def evaluate(self):
+        """Check each bazaar for deals and add it to the snapshot, off the key threads."""
+        while True:
+            item = self.to_evaluate.get()
+            if item is END_OF_QUEUE:
+                return
+            user_id, bazaar_data = item
+            bazaar_call.record_bazaar(user_id, bazaar_data, None, self.snapshot, self.alerter, self.publisher,
+                                      self.history)
+            if self.first_deal is None and self.alerter.alerts:
+                self.first_deal = time.monotonic() - self.started
+                print(f"First deal found {self.first_deal:.1f}s after the start.")
+
+    def _drain(self, stage_queue):
+        """Empty an input queue a stage stopped reading early (every key died), so its feeder can't hang on it."""
+        if self.api_keys and not all(api_key.disabled for api_key in self.api_keys):
+            return  # The pool only returns with keys left once it has read the end of the queue
+        self.stop.set()
+        while True:
+            try:
+                if stage_queue.get(timeout=1) is END_OF_QUEUE:
+                    return
+            except queue.Empty:
+                continue
+
+    def describe_progress(self):
+        return (f"Discovered {USERS_PROCESSED.value(stage='1', result='listed')}, "
+                f"filtered {USERS_PROCESSED.value(stage='2')}, bazaars {USERS_PROCESSED.value(stage='4')}, "
+                f"deals {self.alerter.alerts}; queued {self.to_filter.qsize()}/{self.to_fetch.qsize()}/"
+                f"{self.to_evaluate.qsize()}")
+
+    def run(self, user_ids, checkpoint, output):
+        """Run every stage until discovery runs out (or Ctrl-C), then let the queues drain and close."""
+        threads = [threading.Thread(target=target, args=args, name=name) for name, target, args in (
+            ('discover', self.discover, (user_ids, checkpoint)),
+            ('filter', self.filter, (output,)),
+            ('fetch', self.fetch, ()),
+            ('evaluate', self.evaluate, ()),
+        )]
+        for thread in threads:
+            thread.start()
+        next_progress = time.monotonic() + PROGRESS_SECONDS
+        for thread in threads:
+            while thread.is_alive():
+                try:
+                    thread.join(timeout=1)
+                except KeyboardInterrupt:
+                    print("Stopping: no new IDs are taken, users already found go through every stage.")
+                    self.stop.set()
+                if time.monotonic() >= next_progress:
+                    print(self.describe_progress())
+                    next_progress += PROGRESS_SECONDS
+        print(self.describe_progress())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run stages 1, 2, 4 and the deal check together as one stream.")
+    metrics.add_arguments(parser, gui=False)
+    parser.add_argument('--keys-file', help="CSV of key,holder_name[,calls_per_minute]")
+    parser.add_argument('--start-id', type=int, default=scraper.START_ID)
+    parser.add_argument('--end-id', type=int, default=scraper.END_ID)
+    parser.add_argument('--fused', action='store_true', help="fetch the profile with the account status")
+    parser.add_argument('--probe', action='store_true', help="sample the ID space and skip empty regions")
+    parser.add_argument('--query-service', metavar='URL', help="send each bazaar to query_service.py at URL")
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE)
+    args = parser.parse_args()
+    metrics.start_exporters(args)
+
+    api_keys = load_keys(args.keys_file) if args.keys_file else list(scraper.api_keys)
+    cache = ResponseCache()
+    index = StateIndex()  # Seeded from the old CSVs when it is first created
+    journal = Journal('inactivity_journal.log', index, {
+        BLACKLISTED: 'blacklist.csv',
+        INACTIVE: 'recently_checked.csv',
+    })
+    journal.start()
+
+    # The same output files as the stage scripts, so either can pick up where the other left off
+    user_ids = range(args.start_id, args.end_id + 1)
+    if args.probe:
+        status = (lambda user_id, api_key: scraper.fused_status(user_id, api_key)[0]) if args.fused \
+            else scraper.public_status
+        user_ids = IDProber(KeyPool(api_keys, cache), status).plan(args.start_id, args.end_id, index)
+    checkpoint = RangeCheckpoint('active_users.checkpoint', 'active_users.csv', ['User ID'])
+    user_ids = checkpoint.resume(user_ids)
+    output = BatchWriter('active_users_filtered.csv', header=['User ID', 'Last Action Timestamp'])
+    alerter = DealAlerter(SellPrices(), [StdoutSink(), FileSink('deals.jsonl')])
+    publisher = QueryServicePublisher(args.query_service) if args.query_service else None
+    history = BazaarHistory()  # So budgeted stage 4 runs know these owners too
+    if not history.existed:
+        import_bazaar_users(history)
+
+    pipeline = Pipeline(api_keys, cache, index, journal, alerter, publisher, args.fused, args.queue_size, history)
+    pipeline.run(user_ids, checkpoint, output)
+
+    output.close()
+    journal.close()
+    inactivity_filter.export_active_users(index, 'active_users_filtered.csv')
+    # Only the active users this run reached were fetched, so the others keep their listings (those of
+    # sorted_bazaars.csv if no crawl has written a keyframe yet)
+    bazaar_deltas.write_crawl(pipeline.snapshot, 'sorted_bazaars.bzs', complete=False, seed_csv='sorted_bazaars.csv')
+    alerter.close()
+    if publisher is not None:
+        publisher.close()
+    history.save()
+    index.close()
+    cache.report()
+    cache.close()
+    metrics.finish_exporters(args)
+
+
+if __name__ == "__main__":
+    main()
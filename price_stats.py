@@ -0,0 +1,213 @@
+import csv
+import json
+import math
+import os
+import sys
+import time
+
+from bazaar_deltas import market_rows
+from csv_loader import load_listings
+
+# Quantiles come back within 1% of a listed price; 2048 buckets cover prices from $2 to well past $1e17
+RELATIVE_ACCURACY = 0.01
+MAX_BUCKETS = 2048
+
+# Running estimates keep half their weight per crawl, so a market that moves is followed within a few crawls
+DECAY = 0.5
+FORGET_BELOW = 0.01  # Items whose weight has decayed below this are dropped
+
+# Automatic sell prices: the lower quartile of asking prices, only for items seen often enough to trust it.
+# The sketch can put the quartile up to RELATIVE_ACCURACY above a listed price, so the sell price is taken SELL_MARGIN
+# below it; otherwise listings priced right at the quartile would count as deals through rounding alone.
+TARGET_QUANTILE = 0.25
+MIN_LISTINGS = 20
+SELL_MARGIN = 2 * RELATIVE_ACCURACY
+
+
+# Log-bucketed quantile sketch (DDSketch style): bounded size, relative-error quantiles, merged by adding buckets
+class QuantileSketch:
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY, max_buckets=MAX_BUCKETS):
+        """Initialize an empty sketch whose quantiles are within relative_accuracy of a seen value."""
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.buckets = {}  # bucket index -> weight
+        self.count = 0.0
+
+    def add(self, value, weight=1.0):
+        key = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[key] = self.buckets.get(key, 0.0) + weight
+        self.count += weight
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def merge(self, other):
+        for key, weight in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0.0) + weight
+        self.count += other.count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def scale(self, factor):
+        """Multiply every weight by factor (used to decay older crawls)."""
+        self.buckets = {key: weight * factor for key, weight in self.buckets.items()}
+        self.count *= factor
+
+    def _collapse(self):
+        # Fold the lowest buckets together; only the cheapest outliers lose precision
+        keys = sorted(self.buckets)
+        excess = keys[:len(keys) - self.max_buckets + 1]
+        self.buckets[excess[-1]] = sum(self.buckets.pop(key) for key in excess)
+
+    def quantile(self, q):
+        """Return the value at quantile q (0..1), or None for an empty sketch."""
+        if self.count <= 0:
+            return None
+        rank = q * self.count
+        cumulative = 0.0
+        keys = sorted(self.buckets)
+        for key in keys:
+            cumulative += self.buckets[key]
+            if cumulative >= rank:
+                break
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def to_dict(self):
+        return {'buckets': {str(key): weight for key, weight in self.buckets.items()}, 'count': self.count}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls()
+        sketch.buckets = {int(key): weight for key, weight in data['buckets'].items()}
+        sketch.count = data['count']
+        return sketch
+
+
+# Count, min, max and price sketch for one item
+class ItemStats:
+    def __init__(self):
+        """Initialize empty statistics."""
+        self.count = 0.0
+        self.min = None
+        self.max = None
+        self.sketch = QuantileSketch()
+        self.updated = 0
+
+    def add(self, price):
+        self.count += 1
+        self.min = price if self.min is None else min(self.min, price)
+        self.max = price if self.max is None else max(self.max, price)
+        self.sketch.add(price)
+
+    def to_dict(self):
+        return {'count': self.count, 'min': self.min, 'max': self.max, 'updated': self.updated,
+                'sketch': self.sketch.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.count, stats.min, stats.max, stats.updated = data['count'], data['min'], data['max'], data['updated']
+        stats.sketch = QuantileSketch.from_dict(data['sketch'])
+        return stats
+
+
+# Running per-item market estimates, carried from crawl to crawl in a small JSON file
+class PriceStats:
+    def __init__(self, path='price_stats.json'):
+        """Load the running estimates, or start empty."""
+        self.path = path
+        self.items = {}  # item name -> ItemStats
+        try:
+            with open(path, 'r') as file:
+                self.items = {name: ItemStats.from_dict(data) for name, data in json.load(file).items()}
+        except FileNotFoundError:
+            pass
+
+    def add_crawl(self, crawl, decay=DECAY):
+        """Fold one crawl's {item name: ItemStats} into the running estimates.
+
+        Older weight is decayed first; min and max describe the latest crawl that saw the item.
+        """
+        now = int(time.time())
+        for name in list(self.items):
+            stats = self.items[name]
+            stats.count *= decay
+            stats.sketch.scale(decay)
+            if name not in crawl and stats.count < FORGET_BELOW:
+                del self.items[name]
+        for name, fresh in crawl.items():
+            stats = self.items.get(name)
+            if stats is None:
+                stats = self.items[name] = ItemStats()
+            stats.count += fresh.count
+            stats.min, stats.max = fresh.min, fresh.max
+            stats.sketch.merge(fresh.sketch)
+            stats.updated = now
+
+    def sell_prices(self, quantile=TARGET_QUANTILE, min_listings=MIN_LISTINGS, margin=SELL_MARGIN):
+        """Return {item name: sell price} for every item with enough listings behind it, margin below the quantile."""
+        return {name: math.floor(stats.sketch.quantile(quantile) * (1 - margin))
+                for name, stats in sorted(self.items.items()) if stats.count >= min_listings}
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({name: stats.to_dict() for name, stats in self.items.items()}, file)
+        os.replace(tmp_path, self.path)
+
+
+# Function to stream one crawl's listings into per-item statistics
+def crawl_stats(rows):
+    """rows yields (item name, price); $1 price-locked listings are left out like in the profit stage."""
+    crawl = {}
+    for item_name, price in rows:
+        if price <= 1:
+            continue
+        stats = crawl.get(item_name)
+        if stats is None:
+            stats = crawl[item_name] = ItemStats()
+        stats.add(price)
+    return crawl
+
+
+# Function to read (item name, price) from the current market: a snapshot plus the changes logged since
+def snapshot_prices(path):
+    for player_id, item_name, price, quantity in market_rows(path):
+        yield item_name, price
+
+
+# Function to read (item name, price) from a sorted_bazaars.csv
+def csv_prices(csv_file):
+    listings = load_listings(csv_file)
+    for item_id, price in zip(listings.columns['item_id'], listings.columns['price']):
+        yield listings.item_names[item_id], price
+
+
+# Function to write sell prices in the items.csv format, so load_user_input can read them
+def write_sell_prices(sell_prices, csv_file):
+    tmp_file = csv_file + '.tmp'
+    with open(tmp_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Item Name', 'Sell Price'])
+        writer.writerows(sell_prices.items())
+    os.replace(tmp_file, csv_file)
+
+
+# Function to fold a finished crawl into the running estimates and refresh the automatic sell prices
+def update(source='sorted_bazaars.bzs', stats_path='price_stats.json', sell_prices_csv='auto_items.csv'):
+    stats = PriceStats(stats_path)
+    if source.endswith('.csv'):
+        stats.add_crawl(crawl_stats(csv_prices(source)))
+    else:
+        stats.add_crawl(crawl_stats(snapshot_prices(source)))
+    stats.save()
+    sell_prices = stats.sell_prices()
+    write_sell_prices(sell_prices, sell_prices_csv)
+    print(f"Price statistics for {len(stats.items)} items; wrote {len(sell_prices)} sell prices to {sell_prices_csv}.")
+    return sell_prices
+
+
+if __name__ == "__main__":
+    # python price_stats.py [sorted_bazaars.bzs | sorted_bazaars.csv]
+    update(sys.argv[1] if len(sys.argv) > 1 else 'sorted_bazaars.bzs')
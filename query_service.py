@@ -0,0 +1,259 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from bazaar_deltas import apply, diff_bazaar, load_market
+from deal_alerts import SellPriceWatcher
+from order_book import BAZAAR_LINK, OrderBook
+
+DEFAULT_PORT = 8766
+RELOAD_CHECK_SECONDS = 1.0  # How often the snapshot files are checked for a finished crawl
+PUBLISH_SECONDS = 0.5  # How long the crawler batches bazaars before sending them to the service
+DEFAULT_LIMIT = 100  # Listings returned when a query doesn't say how many
+
+
+# The latest bazaar data, indexed by item (listings sorted by price) and by player.
+# Loaded from the snapshot and its delta log, rebuilt when a crawl finishes, and patched in between
+# with each bazaar the crawler sends as it is fetched.
+class MarketIndex:
+    def __init__(self, path='sorted_bazaars.bzs'):
+        """Load the current market from the snapshot at path and its delta log."""
+        self.path = path
+        self.lock = threading.Lock()
+        self.signature = None
+        self.market = {}  # player_id -> [(item_name, price, quantity)]
+        self.book = OrderBook()
+        self.updates = 0
+        self.reload_if_changed()
+
+    def _disk_signature(self):
+        signature = []
+        for path in (self.path, self.path + '.delta'):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def reload_if_changed(self):
+        """Rebuild from disk if the crawler wrote a new keyframe or delta; queries use the old index meanwhile."""
+        signature = self._disk_signature()
+        if signature == self.signature:
+            return False
+        market = load_market(self.path)
+        book = OrderBook()
+        book.load_rows((player_id, item_name, price, quantity)
+                       for player_id, listings in market.items() for item_name, price, quantity in listings)
+        with self.lock:
+            self.market, self.book, self.signature = market, book, signature
+        print(f"Loaded {sum(len(listings) for listings in market.values())} listings "
+              f"of {len(market)} players from {self.path}.")
+        return True
+
+    def update(self, player_id, listings):
+        """Replace one player's listings ([(item_name, price, quantity)]) with what the crawler just fetched."""
+        with self.lock:
+            records = diff_bazaar(player_id, self.market.get(player_id, []), listings)
+            for record in records:
+                apply(self.market, record)
+            self.book.apply(records)
+            self.updates += 1
+
+    def cheapest(self, item_name, n, min_price=1):
+        with self.lock:
+            book = self.book.items.get(item_name.lower())
+            return [] if book is None else _listings(book, book.cheapest(n, min_price))
+
+    def under(self, max_price, item_name=None, limit=DEFAULT_LIMIT, min_price=1):
+        """Listings priced below max_price, cheapest first: of one item, or of every item."""
+        with self.lock:
+            if item_name is not None:
+                book = self.book.items.get(item_name.lower())
+                return [] if book is None else _listings(book, book.between(min_price, max_price)[:limit])
+            found = []
+            for book in self.book.items.values():
+                if book.prices and book.prices[0] < max_price:  # Most items have nothing that cheap
+                    found.extend(_listings(book, book.between(min_price, max_price)[:limit]))
+        found.sort(key=lambda listing: listing['price'])
+        return found[:limit]
+
+    def holders(self, item_name):
+        """Players holding an item, with their total quantity and lowest price, cheapest first."""
+        holders = {}
+        with self.lock:
+            book = self.book.items.get(item_name.lower())
+            for price, player_id, quantity in (book.listings if book is not None else []):
+                holder = holders.get(player_id)
+                if holder is None:
+                    holders[player_id] = {'player_id': player_id, 'lowest_price': price, 'quantity': quantity,
+                                          'bazaar_link': BAZAAR_LINK.format(player_id=player_id)}
+                else:
+                    holder['quantity'] += quantity
+        return list(holders.values())
+
+    def player(self, player_id):
+        with self.lock:
+            listings = list(self.market.get(player_id, []))
+        return [{'player_id': player_id, 'item_name': item_name, 'price': price, 'quantity': quantity}
+                for item_name, price, quantity in listings]
+
+    def deals(self, sell_prices, n):
+        with self.lock:
+            return self.book.top_profitable(sell_prices, n)
+
+    def stats(self):
+        with self.lock:
+            return {'players': len(self.market), 'items': len(self.book.items),
+                    'listings': sum(len(listings) for listings in self.market.values()), 'updates': self.updates}
+
+
+def _listings(book, listings):
+    return [{'player_id': player_id, 'item_name': book.item_name, 'price': price, 'quantity': quantity,
+             'bazaar_link': BAZAAR_LINK.format(player_id=player_id)} for price, player_id, quantity in listings]
+
+
+# Sell prices for /deals: the derived auto_items.csv with the user's items.csv on top, each reloaded on change
+class SellPrices:
+    def __init__(self, items_csv='items.csv', auto_items_csv='auto_items.csv'):
+        """Watch both files."""
+        self.watchers = [SellPriceWatcher(auto_items_csv), SellPriceWatcher(items_csv)]
+
+    def get(self):
+        sell_prices = {}
+        for watcher in self.watchers:
+            sell_prices.update(watcher.get())
+        return sell_prices
+
+
+# Function to serve the index over HTTP from a background thread
+def serve(index, sell_prices, port=DEFAULT_PORT, host='127.0.0.1'):
+    """GET /cheapest?item=&n=, /under?price=[&item=][&limit=], /holders?item=, /player?id=, /deals?n=, /stats;
+    POST /update with {"bazaars": [[player_id, [[item_name, price, quantity], ...]], ...]} from the crawler.
+    """
+    class QueryHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep-alive, so a client asking many questions reuses its connection
+        disable_nagle_algorithm = True  # Headers and body go out as two writes; don't hold the second back
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {name: values[0] for name, values in parse_qs(url.query).items()}
+            try:
+                if url.path == '/cheapest':
+                    reply = index.cheapest(query['item'], int(query.get('n', 10)), int(query.get('min_price', 1)))
+                elif url.path == '/under':
+                    reply = index.under(int(query['price']), query.get('item'),
+                                        int(query.get('limit', DEFAULT_LIMIT)), int(query.get('min_price', 1)))
+                elif url.path == '/holders':
+                    reply = index.holders(query['item'])
+                elif url.path == '/player':
+                    reply = index.player(int(query['id']))
+                elif url.path == '/deals':
+                    reply = index.deals(sell_prices.get(), int(query.get('n', 50)))
+                elif url.path == '/stats':
+                    reply = index.stats()
+                else:
+                    self.send_error(404)
+                    return
+            except (KeyError, ValueError) as e:
+                self.send_error(400, f"Bad query: {e}")
+                return
+            self.reply(reply)
+
+        def do_POST(self):
+            if self.path != '/update':
+                self.send_error(404)
+                return
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            for player_id, listings in body['bazaars']:
+                index.update(player_id, [tuple(listing) for listing in listings])
+            self.reply({'accepted': len(body['bazaars'])})
+
+        def reply(self, body):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Sends each bazaar to a running query service as the crawler fetches it, without ever holding up the crawl
+class QueryServicePublisher:
+    def __init__(self, url, interval=PUBLISH_SECONDS, max_queued=10000):
+        """Batch bazaars for interval seconds per POST; bazaars beyond max_queued are dropped."""
+        self.url = url.rstrip('/') + '/update'
+        self.interval = interval
+        self.queue = queue.Queue(max_queued)
+        self.failing = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def publish(self, player_id, bazaar_data):
+        listings = [[item['name'], item['price'], item['quantity']] for item in bazaar_data or []]
+        try:
+            self.queue.put_nowait([player_id, listings])
+        except queue.Full:
+            pass  # The service catches up from the delta log when the crawl finishes
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.interval
+            while batch[-1] is not None and time.monotonic() < deadline:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                stopping = True
+                batch.pop()
+            if batch:
+                self._send(batch)
+
+    def _send(self, bazaars):
+        try:
+            requests.post(self.url, json={'bazaars': bazaars}, timeout=10).raise_for_status()
+            self.failing = False
+        except requests.RequestException as e:
+            if not self.failing:
+                print(f"Query service at {self.url} not reachable ({e}); its updates are dropped until it is.")
+            self.failing = True
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer bazaar queries from an in-memory index of the latest crawl.")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--snapshot', default='sorted_bazaars.bzs')
+    args = parser.parse_args()
+
+    market_index = MarketIndex(args.snapshot)
+    server = serve(market_index, SellPrices(), args.port, args.host)
+    print(f"Query service listening on http://{args.host}:{args.port}", flush=True)
+    try:
+        while True:
+            time.sleep(RELOAD_CHECK_SECONDS)
+            market_index.reload_if_changed()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,63 @@
+import heapq
+import itertools
+import time
+
+from state_index import LISTED, ACTIVE, INACTIVE, BLACKLISTED
+
+DAY = 86400
+ACTIVE_WINDOW = 40 * DAY  # Same 40 days as is_active in the inactivity filter
+UNKNOWN_INACTIVITY = 365 * DAY  # Assumed when a user was imported without a last action timestamp
+
+# How long a user keeps its status before it is worth another call
+ACTIVE_TTL = 7 * DAY  # Only used when the last action is unknown
+INACTIVE_TTL_FRACTION = 0.25  # Re-check after a quarter of the time they had already been gone
+INACTIVE_MIN_TTL = 1 * DAY
+INACTIVE_MAX_TTL = 180 * DAY
+BLACKLIST_TTL = 60 * DAY
+
+
+# Function to classify a fresh last action timestamp the way the inactivity filter does
+def status_for_last_action(last_action, now=None):
+    now = int(time.time()) if now is None else now
+    return ACTIVE if last_action and now - last_action <= ACTIVE_WINDOW else INACTIVE
+
+
+# Function to score how likely a user's stored status is out of date (0 means not due yet)
+def recheck_score(status, checked, last_action, now):
+    elapsed = now - checked
+    if status == ACTIVE:
+        if last_action:
+            # Certain to be inactive now unless they came back, so these go first
+            return 2.0 if now - last_action > ACTIVE_WINDOW else 0.0
+        return 1.0 if elapsed >= ACTIVE_TTL else 0.0
+    if status == INACTIVE:
+        inactive_for = checked - last_action if last_action else UNKNOWN_INACTIVITY
+        ttl = min(max(inactive_for * INACTIVE_TTL_FRACTION, INACTIVE_MIN_TTL), INACTIVE_MAX_TTL)
+        if elapsed < ttl:
+            return 0.0
+        # Someone gone 41 days is far more likely to be back than someone gone 4 years
+        return elapsed / (elapsed + inactive_for)
+    if status == BLACKLISTED:
+        return 0.01 if elapsed >= BLACKLIST_TTL else 0.0
+    return 0.0
+
+
+# Function to list the users that are due for a re-check, most likely to have changed first
+def due_users(index, now=None, limit=None):
+    now = int(time.time()) if now is None else now
+    scored = []
+    for status in (ACTIVE, INACTIVE, BLACKLISTED):
+        for user_id in index.ids_with_status(status):
+            score = recheck_score(status, index.checked(user_id), index.last_action(user_id), now)
+            if score > 0:
+                scored.append((score, user_id))
+    if limit is not None:
+        scored = heapq.nlargest(limit, scored)
+    else:
+        scored.sort(reverse=True)
+    return [user_id for score, user_id in scored]
+
+
+# Function to build the work list for one run: never-checked users first, then the due re-checks
+def plan_run(index, now=None, limit=None):
+    return itertools.chain(index.ids_with_status(LISTED), due_users(index, now, limit))
@@ -0,0 +1,107 @@
+import json
+import sqlite3
+import threading
+import time
+
+from metrics import REGISTRY
+
+CACHE_LOOKUPS = REGISTRY.counter('api_cache_lookups_total', 'Response cache lookups by result.')
+
+# How long a cached response stays valid, per selection (seconds)
+SELECTION_TTLS = {
+    'publicStatus': 7 * 86400,  # Bans rarely change
+    'profile': 6 * 3600,
+    'bazaar': 5 * 60,  # Listings get bought quickly
+}
+DEFAULT_TTL = 5 * 60
+
+
+# Local cache of Torn API responses keyed by (user_id, selections)
+class ResponseCache:
+    def __init__(self, path='api_cache.sqlite', ttls=None, max_entries=1000000):
+        """Open (or create) the SQLite cache; the oldest entries are evicted beyond max_entries."""
+        self.ttls = dict(SELECTION_TTLS, **(ttls or {}))
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+            user_id INTEGER NOT NULL,
+            selections TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            body TEXT NOT NULL,
+            PRIMARY KEY (user_id, selections))''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_fetched_at ON responses (fetched_at)')
+        self.entries = self._count()
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def ttl(self, selections):
+        """A combined request is only as fresh as its shortest-lived selection."""
+        return min(self.ttls.get(selection, DEFAULT_TTL) for selection in selections.split(','))
+
+    def _lookup(self, user_id, selections):
+        row = self.conn.execute(
+            'SELECT fetched_at, body FROM responses WHERE user_id = ? AND selections = ?',
+            (user_id, selections)).fetchone()
+        if row is None or time.time() - row[0] > self.ttl(selections):
+            return None
+        return row
+
+    def get(self, user_id, selections):
+        """Return the cached JSON for a request, or None if it is missing or expired.
+
+        A combined request is also answered from its selections' own entries when all of them are fresh.
+        """
+        with self.lock:
+            row = self._lookup(user_id, selections)
+            rows = [row] if row is not None else []
+            if row is None and ',' in selections:
+                rows = [self._lookup(user_id, selection) for selection in selections.split(',')]
+            if not rows or None in rows:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(result='miss')
+                return None
+            self.hits += 1
+            CACHE_LOOKUPS.inc(result='hit')
+            data = {}
+            for fetched_at, body in sorted(rows):  # Entries may overlap, so the newest wins
+                data.update(json.loads(body))
+            return data
+
+    def put(self, user_id, selections, data, fetched_at=None):
+        """Store a successful response, evicting the oldest entries if the cache is full.
+
+        A combined response is stored under each of its selections too, so a later single-selection
+        request (e.g. the bazaar crawl after a fused profile,bazaar call) is a hit.
+        """
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        keys = [selections] + (selections.split(',') if ',' in selections else [])
+        body = json.dumps(data)
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO responses (user_id, selections, fetched_at, body) VALUES (?, ?, ?, ?)',
+                [(user_id, key, fetched_at, body) for key in keys])
+            self.entries += len(keys)  # Overcounts replaced rows, so recount before evicting anything
+            if self.entries >= self.max_entries:
+                self.entries = self._count()
+            if self.entries >= self.max_entries:
+                # Drop the oldest tenth in one go rather than one row per insert
+                self.conn.execute(
+                    'DELETE FROM responses WHERE rowid IN (SELECT rowid FROM responses ORDER BY fetched_at LIMIT ?)',
+                    (max(self.max_entries // 10, 1),))
+                self.entries = self._count()
+            self.conn.commit()
+
+    def report(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0
+        print(f"API cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), {self.entries} entries")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,176 @@
+import array
+import mmap
+import os
+import threading
+import time
+
+from csv_loader import load_ints
+from journal import load_snapshot
+
+# Status codes stored per user ID (one byte each)
+UNKNOWN = 0
+LISTED = 1  # Found by the account scraper, not checked for activity yet
+ACTIVE = 2
+INACTIVE = 3
+BLACKLISTED = 4
+BANNED = 5
+
+STATUS_NAMES = {
+    UNKNOWN: 'unknown',
+    LISTED: 'listed',
+    ACTIVE: 'active',
+    INACTIVE: 'inactive',
+    BLACKLISTED: 'blacklisted',
+    BANNED: 'banned',
+}
+
+# One file per column, each a flat array indexed by user ID
+COLUMNS = {
+    'status': 'B',  # Status code from above
+    'checked': 'I',  # Unix time the user was last checked
+    'last_action': 'I',  # Last action timestamp seen at that check (0 if unknown)
+}
+
+DEFAULT_CAPACITY = 3500001  # Covers END_ID of the account scraper
+
+
+# Memory-mapped per-user state shared by every stage
+class StateIndex:
+    def __init__(self, path='user_state', capacity=DEFAULT_CAPACITY):
+        """Open the index files that start with path, creating them from the old CSVs if there are none.
+
+        Every stage opens the index this way, so whichever runs first seeds it; an empty index would
+        otherwise have the journal overwrite blacklist.csv and recently_checked.csv with nothing.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.existed = os.path.exists(self._column_file('status'))
+        self.files = {}
+        self.maps = {}
+        self.columns = {}
+        if not self.existed:
+            self._create(capacity)
+        self._map(capacity)
+        status = bytes(self.columns['status'])
+        self.counts = {code: status.count(code) for code in STATUS_NAMES}
+
+    def _column_file(self, name):
+        return f"{self.path}.{name}.bin"
+
+    def _create(self, capacity):
+        """Seed a new index from the CSVs under temporary names, and only then move it into place.
+
+        The status file is moved last, so a crash while seeding never leaves an index that looks complete.
+        """
+        final_path, self.path = self.path, self.path + '.seeding'
+        for name in COLUMNS:
+            if os.path.exists(self._column_file(name)):
+                os.remove(self._column_file(name))  # Left by a crash during an earlier seeding
+        self._map(capacity)
+        self.counts = {code: 0 for code in STATUS_NAMES}
+        self.counts[UNKNOWN] = self.capacity
+        import_csvs(self)
+        self._unmap()
+        seeded = {name: self._column_file(name) for name in COLUMNS}
+        self.path = final_path
+        for name in sorted(COLUMNS, key=lambda name: name == 'status'):
+            os.replace(seeded[name], self._column_file(name))
+
+    def _map(self, capacity):
+        if os.path.exists(self._column_file('status')):
+            capacity = max(capacity, os.path.getsize(self._column_file('status')))
+        for name, typecode in COLUMNS.items():
+            size = capacity * array.array(typecode).itemsize
+            file = open(self._column_file(name), 'a+b')
+            if os.path.getsize(file.name) < size:
+                file.truncate(size)  # Sparse on disk until a page is written
+            self.files[name] = file
+            self.maps[name] = mmap.mmap(file.fileno(), size)
+            self.columns[name] = memoryview(self.maps[name]).cast(typecode)
+        self.capacity = capacity
+
+    def _unmap(self):
+        for name in COLUMNS:
+            self.columns[name].release()
+            self.maps[name].close()
+            self.files[name].close()
+
+    def _grow(self, user_id):
+        self._unmap()
+        self._map(max(user_id + 1, self.capacity * 2))
+
+    def status(self, user_id):
+        if user_id >= self.capacity:
+            return UNKNOWN
+        return self.columns['status'][user_id]
+
+    def checked(self, user_id):
+        if user_id >= self.capacity:
+            return 0
+        return self.columns['checked'][user_id]
+
+    def last_action(self, user_id):
+        if user_id >= self.capacity:
+            return 0
+        return self.columns['last_action'][user_id]
+
+    def status_range(self, start, end):
+        """Return the status bytes of IDs start to end - 1 (cut short at the end of the index)."""
+        return self.maps['status'][start:end]
+
+    def highest_id(self):
+        """Return the highest user ID that has any status, or 0 if none does."""
+        return max(len(self.maps['status'][:].rstrip(b'\0')) - 1, 0)
+
+    def set(self, user_id, status, checked=None, last_action=None):
+        """Store a status (and the time it was checked, defaulting to now) for a user."""
+        with self.lock:
+            if user_id >= self.capacity:
+                self._grow(user_id)
+            self.counts[self.columns['status'][user_id]] -= 1
+            self.counts[status] += 1
+            self.columns['status'][user_id] = status
+            self.columns['checked'][user_id] = int(time.time()) if checked is None else checked
+            if last_action is not None:
+                self.columns['last_action'][user_id] = last_action
+
+    def ids_with_status(self, status):
+        """Yield every user ID that has the given status, scanning the status bytes in C."""
+        status_map = self.maps['status']
+        code = bytes([status])
+        position = status_map.find(code)
+        while position != -1:
+            yield position
+            position = status_map.find(code, position + 1)
+
+    def flush(self):
+        """Write dirty pages back to disk."""
+        with self.lock:
+            for column_map in self.maps.values():
+                column_map.flush()
+
+    def close(self):
+        self.flush()
+        self._unmap()
+
+
+# Function to seed a fresh index from the CSV outputs of earlier runs
+def import_csvs(index, active_users_csv='active_users.csv', filtered_csv='active_users_filtered.csv',
+                recently_checked_csv='recently_checked.csv', blacklist_csv='blacklist.csv'):
+    """Later files win, so a user found by the scraper and then blacklisted ends up blacklisted.
+
+    Imported users count as checked now, since the CSVs don't say when they were checked.
+    """
+    for csv_file, status in ((active_users_csv, LISTED), (filtered_csv, ACTIVE),
+                             (recently_checked_csv, INACTIVE), (blacklist_csv, BLACKLISTED)):
+        for user_id in load_snapshot(csv_file):
+            index.set(user_id, status)
+
+    # The filtered users also carry their last action timestamp
+    try:
+        user_ids, last_actions = load_ints(filtered_csv, (0, 1))
+    except FileNotFoundError:
+        user_ids, last_actions = [], []
+    for user_id, last_action in zip(user_ids, last_actions):
+        index.set(user_id, index.status(user_id), last_action=last_action)
+    index.flush()
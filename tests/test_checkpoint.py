@@ -0,0 +1,59 @@
+import importlib
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bazaar_deltas
+from bazaar_snapshot import SnapshotWriter
+from checkpoint import RangeCheckpoint, format_runs, parse_runs
+
+bazaar_call = importlib.import_module('4_bazaarcall')
+
+
+# Stands in for an APIKey, answering from a dictionary of bazaars and remembering who it was asked for
+class FakeKey:
+    def __init__(self, bazaars):
+        self.bazaars = bazaars
+        self.holder_name = 'fake'
+        self.calls_per_minute = 60
+        self.cache = None
+        self.disabled = False
+        self.fetched = []
+
+    def fetch_user(self, user_id, selections):
+        self.fetched.append(user_id)
+        return {'bazaar': self.bazaars.get(user_id, [])}
+
+    def on_error(self, error):
+        raise error
+
+
+def test_runs_round_trip():
+    assert format_runs([7, 1, 3, 2]) == '1-3 7'
+    assert parse_runs('1-3 7') == [(1, 3), (7, 7)]
+
+
+def test_resume_fetches_ids_new_to_a_finished_range(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    keyframe = SnapshotWriter()
+    keyframe.add(1000, 'Xanax', 800000, 1)
+    keyframe.add(1500, 'Xanax', 810000, 2)
+    keyframe.write('sorted_bazaars.bzs')
+
+    # The earlier run crawled [1000, 2000] and stopped with only the range of 1000 finished
+    checkpoint = RangeCheckpoint('crawl.checkpoint', 'crawl.partial', bazaar_call.FIELDNAMES)
+    list(checkpoint.resume([1000, 2000]))
+    checkpoint.add(1000, [1000, 'Xanax', 800000, 1])
+    checkpoint.finish(1000, 'fake', True)
+    checkpoint.close()
+
+    # The resumed run's list has gained 1500, in the same range
+    key = FakeKey({1500: [{'name': 'Xanax', 'price': 810000, 'quantity': 2}]})
+    checkpoint = RangeCheckpoint('crawl.checkpoint', 'crawl.partial', bazaar_call.FIELDNAMES)
+    bazaar_call.process_with_multiple_keys([1000, 1500, 2000], [key], checkpoint, SnapshotWriter(),
+                                           'sorted_bazaars.bzs', full_crawl=False)
+
+    assert sorted(key.fetched) == [1500, 2000]
+    assert sorted(bazaar_deltas.market_rows('sorted_bazaars.bzs')) == [(1000, 'Xanax', 800000, 1),
+                                                                       (1500, 'Xanax', 810000, 2)]
@@ -0,0 +1,22 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bazaar_deltas
+from order_book import OrderBook
+
+
+def test_apply_matches_listings_on_quantity():
+    old = [('Tampon', 100, 1), ('Tampon', 100, 2)]
+    new = [('Tampon', 100, 1), ('Tampon', 100, 3)]
+    book = OrderBook()
+    book.load_rows((7, item_name, price, quantity) for item_name, price, quantity in old)
+    market = {7: list(old)}
+    records = bazaar_deltas.diff_bazaar(7, old, new)
+    for record in records:
+        bazaar_deltas.apply(market, record)
+    book.apply(records)
+
+    assert sorted(book.items['tampon'].listings) == [(100, 7, 1), (100, 7, 3)]
+    assert sorted(market[7]) == sorted(new)
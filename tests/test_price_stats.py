@@ -0,0 +1,12 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from price_stats import PriceStats, crawl_stats
+
+
+def test_listing_at_the_quartile_is_not_below_the_sell_price(tmp_path):
+    stats = PriceStats(str(tmp_path / 'price_stats.json'))
+    stats.add_crawl(crawl_stats([('Brick', 25000)] * 30 + [('Brick', 40000)] * 90))
+    assert stats.sell_prices()['Brick'] < 25000